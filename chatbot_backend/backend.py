@@ -1,20 +1,36 @@
 from fastapi import FastAPI, HTTPException, File, UploadFile, Form, Depends, Request
+from fastapi.responses import FileResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from chat_client import GroqLLM
-from langchain.chains import ConversationalRetrievalChain
+from chat_client import GroqLLM, QueueCallbackHandler
 from langchain.prompts import PromptTemplate
 from passlib.context import CryptContext
+import asyncio
 import shutil
 import uuid
 import json
+import tempfile
 from pydantic_class import *
 from database_utils import *
 from validation_utils import *
 from doc_process_utils import *
 from memory_utils import *
+from registry_utils import *
+from chain_utils import *
+from metrics_utils import *
+from scheduler_utils import *
+from snapshot_utils import *
+from prewarm_utils import *
+from upload_utils import *
 
 # Constants
 UPLOAD_DIR = "uploaded_documents"
+GROQ_API_KEY = "your groq api key"
+GROQ_MODEL = "llama-3.3-70b-versatile"
+# Separates a streamed reply from an error raised after streaming started;
+# clients show what follows it as an error instead of as part of the reply
+STREAM_ERROR_MARKER = "\x00"
 
 # Create upload directory
 os.makedirs(UPLOAD_DIR, exist_ok=True)
@@ -36,6 +52,25 @@ init_db()
 # Document processing utilities
 doc_processor = DocumentProcessor()
 
+# Chatbot metadata cache, kept in sync by the endpoints that write chatbots
+chatbot_registry = ChatbotRegistry()
+
+# Per-collection usage, used to prewarm hot collections after a restart
+access_stats = AccessStats()
+
+
+@app.on_event("startup")
+async def start_background_tasks():
+    access_stats.start()
+    # Runs in the background, cold requests are served while it loads
+    start_prewarm(doc_processor, chatbot_registry, access_stats)
+
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    access_stats.stop()
+
+
 @app.post("/register", response_model=Token)
 async def register(user: UserCreate):
     with get_db() as conn:
@@ -72,34 +107,107 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
         return Token(access_token=access_token, token_type="bearer")
 
 
+def ingest_uploads(user_id: int, documents: List[UploadFile], collection_name: str) -> List[dict]:
+    """
+    Save uploaded files, unpack archives and add every supported document to
+    a collection in one pass, with a single embedding batch and index write
+
+    Args:
+        user_id (int): Owner of the uploads
+        documents (List[UploadFile]): Uploaded files and zip archives
+        collection_name (str): Name of the collection
+
+    Returns:
+        List[dict]: filename, id and chunk_count of every document added, or
+        filename and error of every file left out
+    """
+    work_dir = tempfile.mkdtemp(dir=UPLOAD_DIR, prefix=f"{user_id}_")
+    try:
+        uploads = []
+        for document in documents:
+            file_path = os.path.join(work_dir, f"{uuid.uuid4()}{file_extension(document.filename)}")
+            with open(file_path, "wb") as buffer:
+                shutil.copyfileobj(document.file, buffer)
+            uploads.append((document.filename, file_path))
+        
+        files, skipped = expand_uploads(uploads, work_dir)
+        document_ids = [str(uuid.uuid4()) for _ in files]
+        outcomes = doc_processor.add_documents(
+            [(file_path, document_id) for (_, file_path), document_id in zip(files, document_ids)],
+            collection_name
+        )
+        
+        results = []
+        for (filename, _), document_id in zip(files, document_ids):
+            outcome = outcomes[document_id]
+            if isinstance(outcome, Exception):
+                results.append({"filename": filename, "error": str(outcome)})
+            else:
+                results.append({"filename": filename, "id": document_id, "chunk_count": outcome})
+        results.extend({"filename": filename, "error": reason} for filename, reason in skipped)
+        return results
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+async def ingest_documents(user_id: int, documents: List[UploadFile], collection_name: str) -> List[dict]:
+    try:
+        results = await run_in_threadpool(ingest_uploads, user_id, documents, collection_name)
+    except UploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error ingesting documents: {str(e)}")
+    
+    if not any("id" in result for result in results):
+        raise HTTPException(
+            status_code=422,
+            detail={"message": "None of the uploaded files could be indexed", "documents": results}
+        )
+    return results
+
+
+def discard_documents(collection_name: str, results: List[dict]):
+    # Vectors of documents that never got a row could not be listed or deleted,
+    # and a collection left behind by a failed create makes every retry a 409
+    for result in results:
+        if "id" not in result:
+            continue
+        try:
+            doc_processor.delete_document(collection_name, result["id"])
+        except Exception as e:
+            print(f"Failed to remove document {result['id']} from {collection_name}: {str(e)}")
+
+
+def insert_documents(conn, chatbot_id: int, results: List[dict]):
+    conn.executemany("""
+        INSERT INTO documents (id, chatbot_id, filename, chunk_count)
+        VALUES (?, ?, ?, ?)
+    """, [
+        (result["id"], chatbot_id, result["filename"], result["chunk_count"])
+        for result in results if "id" in result
+    ])
+
+
 @app.post("/chatbots", response_model=ChatbotResponse)
 async def create_chatbot(
     name: str = Form(...),
     description: str = Form(...),
     persona_prompt: str = Form(...),
-    document: UploadFile = File(...),
+    document: List[UploadFile] = File(...),
     token_data: dict = Depends(verify_token)
 ):
     user_id = token_data["user_id"]
     username = token_data["sub"]
+    collection_name = collection_name_for(username, name)
+    
+    # Names that map to an existing collection would add to another chatbot's index
+    if chatbot_registry.get(user_id, name) or await run_in_threadpool(doc_processor.collection_exists, collection_name):
+        raise HTTPException(status_code=409, detail="Chatbot already exists")
     
-    # Save uploaded file
-    file_extension = document.filename.split('.')[-1]
-    file_path = os.path.join(UPLOAD_DIR, f"{user_id}_{uuid.uuid4()}.{file_extension}")
+    # Several files or zip archives may be sent under the same "document" field
+    results = await ingest_documents(user_id, document, collection_name)
     
     try:
-        # Save the uploaded file
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(document.file, buffer)
-        
-        # Process document
-        # doc_processor = DocumentProcessor()
-        collection_name = doc_processor.process_document(
-            file_path, 
-            username, 
-            name
-        )
-        
         with get_db() as conn:
             # Create chatbot
             cursor = conn.execute("""
@@ -113,96 +221,358 @@ async def create_chatbot(
             """, (user_id, name, description, persona_prompt))
             chatbot_id, created_at = cursor.fetchone()
             
-            conn.commit()
+            insert_documents(conn, chatbot_id, results)
             
-            return ChatbotResponse(
-                id=chatbot_id,
-                name=name,
-                description=description,
-                persona_prompt=persona_prompt,
-                created_at=created_at
-            )
+            conn.commit()
     except Exception as e:
-        # Handle any errors during file processing or database insertion
+        # Handle any errors during database insertion
+        await run_in_threadpool(discard_documents, collection_name, results)
         raise HTTPException(status_code=500, detail=f"Error creating chatbot: {str(e)}")
-    finally:
-        # Cleanup uploaded file
-        if os.path.exists(file_path):
-            os.remove(file_path)
+    
+    chatbot_registry.put(user_id, {
+        "id": chatbot_id,
+        "name": name,
+        "description": description,
+        "persona_prompt": persona_prompt,
+        "created_at": created_at
+    })
+    
+    return ChatbotResponse(
+        id=chatbot_id,
+        name=name,
+        description=description,
+        persona_prompt=persona_prompt,
+        created_at=created_at,
+        documents=[DocumentIngestResult(**result) for result in results]
+    )
 
 
 @app.get("/chatbots", response_model=List[ChatbotResponse])
 async def get_chatbots(token_data: dict = Depends(verify_token)):
+    chatbots = chatbot_registry.list_chatbots(token_data["user_id"])
+    
+    return [
+        ChatbotResponse(
+            id=chatbot["id"],
+            name=chatbot["name"],
+            description=chatbot["description"],
+            persona_prompt=chatbot["persona_prompt"],
+            created_at=chatbot["created_at"],
+            linked_collections=chatbot["linked_collections"]
+        )
+        for chatbot in chatbots
+    ]
+
+
+def get_owned_chatbot(token_data: dict, chatbot_name: str) -> dict:
+    chatbot = chatbot_registry.get(token_data["user_id"], chatbot_name)
+    if not chatbot:
+        raise HTTPException(status_code=404, detail="Chatbot not found")
+    return chatbot
+
+
+@app.post("/chatbots/{chatbot_name}/documents", response_model=List[DocumentIngestResult])
+async def add_chatbot_documents(
+    chatbot_name: str,
+    document: List[UploadFile] = File(...),
+    token_data: dict = Depends(verify_token)
+):
+    chatbot = get_owned_chatbot(token_data, chatbot_name)
+    
+    # Only the new documents are embedded and appended to the existing index
+    collection_name = collection_name_for(token_data["sub"], chatbot["name"])
+    results = await ingest_documents(token_data["user_id"], document, collection_name)
+    
+    try:
+        with get_db() as conn:
+            insert_documents(conn, chatbot["id"], results)
+            conn.commit()
+    except Exception as e:
+        await run_in_threadpool(discard_documents, collection_name, results)
+        raise HTTPException(status_code=500, detail=f"Error adding documents: {str(e)}")
+    
+    return [DocumentIngestResult(**result) for result in results]
+
+
+@app.get("/chatbots/{chatbot_name}/documents", response_model=List[DocumentResponse])
+async def get_chatbot_documents(
+    chatbot_name: str,
+    token_data: dict = Depends(verify_token)
+):
+    chatbot = get_owned_chatbot(token_data, chatbot_name)
+    
     with get_db() as conn:
-        chatbots = conn.execute("""
-            SELECT id, name, description, persona_prompt, created_at
-            FROM chatbots
-            WHERE user_id = ?
+        documents = conn.execute("""
+            SELECT id, filename, chunk_count, created_at
+            FROM documents
+            WHERE chatbot_id = ?
             ORDER BY created_at DESC
-        """, (token_data["user_id"],)).fetchall()
-        
-        return [
-            ChatbotResponse(
-                id=chatbot["id"],
-                name=chatbot["name"],
-                description=chatbot["description"],
-                persona_prompt=chatbot["persona_prompt"],
-                created_at=chatbot["created_at"]
-            )
-            for chatbot in chatbots
-        ]
+        """, (chatbot["id"],)).fetchall()
     
+    return [DocumentResponse(**dict(document)) for document in documents]
 
 
-# Global memory manager instance
-chatbot_memory_manager = ChatbotMemoryManager()
+@app.delete("/chatbots/{chatbot_name}/documents/{document_id}")
+async def delete_chatbot_document(
+    chatbot_name: str,
+    document_id: str,
+    token_data: dict = Depends(verify_token)
+):
+    chatbot = get_owned_chatbot(token_data, chatbot_name)
+    
+    with get_db() as conn:
+        document = conn.execute(
+            "SELECT id FROM documents WHERE id = ? AND chatbot_id = ?",
+            (document_id, chatbot["id"])
+        ).fetchone()
+    
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found")
+    
+    try:
+        collection_name = collection_name_for(token_data["sub"], chatbot["name"])
+        removed_chunks = await run_in_threadpool(doc_processor.delete_document, collection_name, document_id)
+        
+        with get_db() as conn:
+            conn.execute("DELETE FROM documents WHERE id = ?", (document_id,))
+            conn.commit()
+        
+        return {"id": document_id, "removed_chunks": removed_chunks}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error deleting document: {str(e)}")
+    
 
 
+@app.put("/chatbots/{chatbot_name}/collections", response_model=ChatbotResponse)
+async def link_chatbot_collections(
+    chatbot_name: str,
+    request: CollectionLinkRequest,
+    token_data: dict = Depends(verify_token)
+):
+    chatbot = get_owned_chatbot(token_data, chatbot_name)
+    
+    linked_collections = []
+    for linked_name in request.chatbot_names:
+        get_owned_chatbot(token_data, linked_name)
+        collection_name = collection_name_for(token_data["sub"], linked_name)
+        if linked_name != chatbot["name"] and collection_name not in linked_collections:
+            linked_collections.append(collection_name)
+    
+    with get_db() as conn:
+        conn.execute("DELETE FROM chatbot_collections WHERE chatbot_id = ?", (chatbot["id"],))
+        conn.executemany(
+            "INSERT INTO chatbot_collections (chatbot_id, collection_name) VALUES (?, ?)",
+            [(chatbot["id"], collection_name) for collection_name in linked_collections]
+        )
+        conn.commit()
+    
+    chatbot = dict(chatbot, linked_collections=sorted(linked_collections))
+    chatbot_registry.put(token_data["user_id"], chatbot)
+    
+    return ChatbotResponse(
+        id=chatbot["id"],
+        name=chatbot["name"],
+        description=chatbot["description"],
+        persona_prompt=chatbot["persona_prompt"],
+        created_at=chatbot["created_at"],
+        linked_collections=chatbot["linked_collections"]
+    )
 
-@app.post("/chatbots/chat")
-async def chat_with_chatbot(
-    request: ChatRequest,
+
+# Global memory manager instance, backed by a store shared by all workers
+chatbot_memory_manager = ChatbotMemoryManager()
+
+
+@app.get("/chatbots/{chatbot_name}/snapshot")
+async def export_chatbot_snapshot(
+    chatbot_name: str,
     token_data: dict = Depends(verify_token)
 ):
-    # Convert chatbot_id to string for memory management
-    chatbot_str_id = str(request.chatbot_name)
+    chatbot = get_owned_chatbot(token_data, chatbot_name)
     username = token_data["sub"]
-
+    collection_name = collection_name_for(username, chatbot["name"])
+    work_dir = tempfile.mkdtemp(dir=UPLOAD_DIR)
+    
     try:
-        # Retrieve chatbot details
-
         with get_db() as conn:
-            chatbot = conn.execute("""
-                SELECT name, description, persona_prompt
-                FROM chatbots 
-                WHERE name = ? AND user_id = (SELECT id FROM users WHERE username = ?)
-            """, (chatbot_str_id, username)).fetchone()
+            documents = conn.execute("""
+                SELECT id, filename, chunk_count, created_at
+                FROM documents
+                WHERE chatbot_id = ?
+                ORDER BY created_at
+            """, (chatbot["id"],)).fetchall()
         
+        index_path = os.path.join(work_dir, INDEX_MEMBER)
+        chunks = await run_in_threadpool(doc_processor.export_collection, collection_name, index_path)
+        messages, _ = chatbot_memory_manager.store.load(username, chatbot["name"])
+        
+        archive_path = os.path.join(work_dir, f"{collection_name}.snapshot.tar")
+        await run_in_threadpool(
+            write_snapshot,
+            archive_path,
+            {
+                "name": chatbot["name"],
+                "description": chatbot["description"],
+                "persona_prompt": chatbot["persona_prompt"]
+            },
+            [dict(document) for document in documents],
+            index_path,
+            chunks,
+            messages_to_dict(messages),
+            EMBEDDING_MODEL
+        )
+    except Exception as e:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        raise HTTPException(status_code=500, detail=f"Error exporting chatbot: {str(e)}")
+    
+    return FileResponse(
+        archive_path,
+        media_type="application/x-tar",
+        filename=os.path.basename(archive_path),
+        background=BackgroundTask(shutil.rmtree, work_dir, ignore_errors=True)
+    )
+
 
-        if not chatbot:
-            raise HTTPException(status_code=404, detail="Chatbot not found")
+@app.post("/chatbots/snapshot", response_model=ChatbotResponse)
+async def import_chatbot_snapshot(
+    snapshot: UploadFile = File(...),
+    name: Optional[str] = Form(None),
+    token_data: dict = Depends(verify_token)
+):
+    user_id = token_data["user_id"]
+    username = token_data["sub"]
+    work_dir = tempfile.mkdtemp(dir=UPLOAD_DIR)
+    
+    try:
+        archive_path = os.path.join(work_dir, "snapshot.tar")
+        with open(archive_path, "wb") as buffer:
+            shutil.copyfileobj(snapshot.file, buffer)
         
-        # Initialize document processor and retriever
-        # doc_processor = DocumentProcessor()
-        retriever = doc_processor.retrieve_collection(username, chatbot['name'])
+        index_path = os.path.join(work_dir, INDEX_MEMBER)
+        contents = await run_in_threadpool(read_snapshot, archive_path, index_path, EMBEDDING_MODEL)
+        chatbot = contents["chatbot"]
+        name = name or chatbot["name"]
         
-        # Initialize Hugging Face models
-        # Note: Replace with your actual Hugging Face API key
+        if chatbot_registry.get(user_id, name):
+            raise HTTPException(status_code=409, detail="Chatbot already exists")
         
-        llm = GroqLLM(
-            groq_api_key="your groq api key",
-            model_name="llama-3.3-70b-versatile"  # You can adjust the model as needed
-        )
+        # Fresh document ids, so a snapshot can be imported more than once
+        id_map = {document["id"]: str(uuid.uuid4()) for document in contents["documents"]}
+        chunks = remap_document_ids(contents["chunks"], id_map)
         
-        # Retrieve existing memory or create new
-        memory = chatbot_memory_manager.get_chatbot_memory(username, chatbot_str_id)
+        # The vectors are installed as they are, nothing is re-embedded
+        collection_name = collection_name_for(username, name)
+        await run_in_threadpool(doc_processor.import_collection, collection_name, index_path, chunks)
         
+        with get_db() as conn:
+            cursor = conn.execute("""
+                INSERT INTO chatbots (user_id, name, description, persona_prompt)
+                VALUES (?, ?, ?, ?) RETURNING id, created_at
+            """, (user_id, name, chatbot["description"], chatbot["persona_prompt"]))
+            chatbot_id, created_at = cursor.fetchone()
+            
+            conn.executemany("""
+                INSERT INTO documents (id, chatbot_id, filename, chunk_count, created_at)
+                VALUES (?, ?, ?, ?, ?)
+            """, [
+                (id_map[document["id"]], chatbot_id, document["filename"], document["chunk_count"], document["created_at"])
+                for document in contents["documents"]
+            ])
+            conn.commit()
+        
+        chatbot_registry.put(user_id, {
+            "id": chatbot_id,
+            "name": name,
+            "description": chatbot["description"],
+            "persona_prompt": chatbot["persona_prompt"],
+            "created_at": created_at
+        })
+        
+        if contents["messages"]:
+            _, version = chatbot_memory_manager.store.load(username, name)
+            chatbot_memory_manager.store.save(username, name, messages_from_dict(contents["messages"]), version)
         
-        # Custom prompt template to incorporate persona and context
-# Custom prompt template to incorporate chatbot name, description, persona, and context
-        prompt_template = PromptTemplate(
-            input_variables=["chat_history", "question", "context"],
-            template="""You are {chatbot_name}, {chatbot_description}
+        return ChatbotResponse(
+            id=chatbot_id,
+            name=name,
+            description=chatbot["description"],
+            persona_prompt=chatbot["persona_prompt"],
+            created_at=created_at
+        )
+    except HTTPException:
+        raise
+    except SnapshotError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid snapshot: {str(e)}")
+    except FileExistsError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error importing chatbot: {str(e)}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+
+def prepare_conversation(
+    request: ChatRequest,
+    token_data: dict,
+    answer_callbacks: Optional[list] = None
+):
+    """
+    Build the conversation chain for a chat message
+    
+    Args:
+        request (ChatRequest): The chat message
+        token_data (dict): Decoded access token of the user
+        answer_callbacks (list, optional): Callbacks receiving the answer's
+            tokens as they are generated, enables streaming
+    
+    Returns:
+        Tuple[ConversationalRetrievalChain, ConversationBufferMemory]: The
+        chain and the memory to save once it has run
+    """
+    # Convert chatbot_id to string for memory management
+    chatbot_str_id = str(request.chatbot_name)
+    username = token_data["sub"]
+    
+    # Retrieve chatbot details from the registry, no DB round trip once cached
+    chatbot = chatbot_registry.get(token_data["user_id"], chatbot_str_id)
+
+    if not chatbot:
+        raise HTTPException(status_code=404, detail="Chatbot not found")
+    
+    access_stats.record(collection_name_for(username, chatbot['name']), token_data["user_id"], chatbot['name'])
+    
+    # Initialize document processor and retriever
+    # doc_processor = DocumentProcessor()
+    retriever = doc_processor.retrieve_collection(
+        username,
+        chatbot['name'],
+        chatbot['linked_collections']
+    )
+    
+    llm = GroqLLM(
+        groq_api_key=GROQ_API_KEY,
+        model_name=GROQ_MODEL,  # You can adjust the model as needed
+        streaming=answer_callbacks is not None,
+        callbacks=answer_callbacks
+    )
+    
+    # Question rewrites are never streamed, so they get their own instance;
+    # the rewrite strategy uses a cheaper model for them
+    condense_llm = None
+    if CONDENSE_STRATEGY == "rewrite" or answer_callbacks is not None:
+        condense_llm = GroqLLM(
+            groq_api_key=GROQ_API_KEY,
+            model_name=CONDENSE_MODEL if CONDENSE_STRATEGY == "rewrite" else GROQ_MODEL
+        )
+    
+    # Retrieve existing memory or create new
+    memory = chatbot_memory_manager.get_chatbot_memory(username, chatbot_str_id)
+    
+    # Custom prompt template to incorporate chatbot name, description, persona, and context
+    prompt_template = PromptTemplate(
+        input_variables=["chat_history", "question", "context"],
+        template="""You are {chatbot_name}, {chatbot_description}
 
 My Persona: {persona_prompt}
 
@@ -213,31 +583,108 @@ Chat History: {chat_history}
 User Question: {question}
 
 Respond as {chatbot_name}, providing a helpful, contextually relevant response that reflects my unique personality and knowledge:""",
-    partial_variables={
-        "chatbot_name": chatbot['name'],
-        "chatbot_description": chatbot['description'],
-        "persona_prompt": chatbot['persona_prompt']
-    }
-)
-        # Create Conversational Retrieval Chain
-        conversation_chain = ConversationalRetrievalChain.from_llm(
-            llm=llm,
-            retriever=retriever,
-            memory=memory,
-            verbose=True,
-            return_source_documents=False,
-            combine_docs_chain_kwargs={
-                "prompt": prompt_template
-            }
+        partial_variables={
+            "chatbot_name": chatbot['name'],
+            "chatbot_description": chatbot['description'],
+            "persona_prompt": chatbot['persona_prompt']
+        }
+    )
+    
+    # Create Conversational Retrieval Chain
+    conversation_chain = build_conversation_chain(
+        llm=llm,
+        retriever=retriever,
+        memory=memory,
+        prompt=prompt_template,
+        condense_llm=condense_llm
+    )
+    return conversation_chain, memory
+
+
+@app.post("/chatbots/chat")
+async def chat_with_chatbot(
+    request: ChatRequest,
+    token_data: dict = Depends(verify_token)
+):
+    username = token_data["sub"]
+
+    try:
+        # Reject while nothing is held, a full queue would otherwise leave the
+        # request waiting for a chain thread
+        llm_scheduler.ensure_capacity()
+        # Retrieval and the LLM calls block, keep them off the event loop
+        conversation_chain, memory = await run_in_threadpool(prepare_conversation, request, token_data)
+        
+        result = await asyncio.get_running_loop().run_in_executor(
+            chain_executor,
+            conversation_chain.invoke,
+            {"question": request.message}
         )
-        result = conversation_chain.invoke({"question": request.message})
         response = result['answer']
         # response = response.split("persona-consistent response:")[-1].strip()
-        chatbot_memory_manager.get_user_memory_manager(username).save_memory(chatbot_str_id)
+        await run_in_threadpool(
+            chatbot_memory_manager.get_user_memory_manager(username).save_memory,
+            str(request.chatbot_name),
+            memory
+        )
         
         return {
             "response": response
         }
     
+    except HTTPException:
+        raise
+    except LLMOverloadedError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers=retry_after_header(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Chat error: {str(e)}")
+
+
+@app.post("/chatbots/chat/stream")
+async def stream_chat_with_chatbot(
+    request: ChatRequest,
+    token_data: dict = Depends(verify_token)
+):
+    username = token_data["sub"]
+    loop = asyncio.get_running_loop()
+    token_queue: asyncio.Queue = asyncio.Queue()
+    
+    try:
+        # Errors cannot change the status once streaming started, reject up front
+        llm_scheduler.ensure_capacity()
+        conversation_chain, memory = await run_in_threadpool(
+            prepare_conversation,
+            request,
+            token_data,
+            answer_callbacks=[QueueCallbackHandler(token_queue, loop)]
+        )
+    except HTTPException:
+        raise
+    except LLMOverloadedError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers=retry_after_header(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Chat error: {str(e)}")
+    
+    def run_chain():
+        try:
+            conversation_chain.invoke({"question": request.message})
+            chatbot_memory_manager.get_user_memory_manager(username).save_memory(str(request.chatbot_name), memory)
+        except Exception as e:
+            loop.call_soon_threadsafe(token_queue.put_nowait, f"{STREAM_ERROR_MARKER}Chat error: {str(e)}")
+        finally:
+            loop.call_soon_threadsafe(token_queue.put_nowait, None)
+    
+    loop.run_in_executor(chain_executor, run_chain)
+    
+    # Waits on the event loop, no worker thread is held between tokens
+    async def token_stream():
+        while (token := await token_queue.get()) is not None:
+            yield token
+    
+    # Plain text chunks, rendered by the client as they arrive
+    return StreamingResponse(token_stream(), media_type="text/plain; charset=utf-8")
+
+
+@app.get("/metrics")
+async def get_metrics():
+    return metrics.snapshot()
@@ -0,0 +1,146 @@
+from typing import Any, Dict, List, Optional
+from langchain.chains import ConversationalRetrievalChain, LLMChain
+from langchain.chains.base import Chain
+from langchain.chains.conversational_retrieval.prompts import CONDENSE_QUESTION_PROMPT
+from langchain.chains.question_answering import load_qa_chain
+from langchain.memory import ConversationBufferMemory
+from langchain.prompts import PromptTemplate
+from langchain_core.callbacks import CallbackManagerForChainRun
+from langchain_core.language_models import BaseLanguageModel
+from langchain_core.retrievers import BaseRetriever
+from context_utils import CONTEXT_TOKEN_BUDGET, ContextPackingRetriever
+from metrics_utils import metrics
+import os
+import re
+
+
+# When to rewrite a follow-up question into a standalone one before retrieval:
+#   always    - one extra LLM round trip for every message with history
+#   never     - retrieve with the question as asked
+#   heuristic - skip the round trip when the question looks self-contained
+#   rewrite   - always rewrite, but with the cheaper CONDENSE_MODEL
+CONDENSE_STRATEGIES = ("always", "never", "heuristic", "rewrite")
+CONDENSE_STRATEGY = os.getenv("CONDENSE_STRATEGY", "heuristic")
+# Fail at startup rather than on every chat
+if CONDENSE_STRATEGY not in CONDENSE_STRATEGIES:
+    raise ValueError(
+        f"Unknown CONDENSE_STRATEGY {CONDENSE_STRATEGY!r}, expected one of {', '.join(CONDENSE_STRATEGIES)}"
+    )
+CONDENSE_MODEL = os.getenv("CONDENSE_MODEL", "llama-3.1-8b-instant")
+
+# Words that usually point back into the conversation
+_REFERENCE_WORDS = {
+    "it", "its", "they", "them", "their", "theirs", "this", "that", "these", "those",
+    "he", "him", "his", "she", "her", "hers", "former", "latter", "above", "previous",
+    "earlier", "same", "else", "again", "more", "also", "one", "ones",
+}
+_FOLLOW_UP_OPENERS = ("and ", "but ", "so ", "then ", "what about", "how about", "what else")
+# Questions shorter than this rarely stand on their own ("why?", "and pricing?")
+_MIN_SELF_CONTAINED_WORDS = 4
+
+
+def is_self_contained(question: str) -> bool:
+    """
+    Guess whether a question can be answered without the chat history
+
+    Args:
+        question (str): Question as asked by the user
+
+    Returns:
+        bool: True if the question needs no rewriting before retrieval
+    """
+    normalized = question.strip().lower()
+    words = re.findall(r"[a-z']+", normalized)
+
+    if len(words) < _MIN_SELF_CONTAINED_WORDS:
+        return False
+    if normalized.startswith(_FOLLOW_UP_OPENERS):
+        return False
+    return not any(word in _REFERENCE_WORDS for word in words)
+
+
+class CondenseQuestionChain(Chain):
+    """
+    Question generator for ConversationalRetrievalChain that applies a
+    condensation strategy instead of always calling the LLM.
+    """
+
+    llm_chain: LLMChain
+    strategy: str = CONDENSE_STRATEGY
+
+    @property
+    def input_keys(self) -> List[str]:
+        return ["question", "chat_history"]
+
+    @property
+    def output_keys(self) -> List[str]:
+        return ["text"]
+
+    def _call(
+        self,
+        inputs: Dict[str, Any],
+        run_manager: Optional[CallbackManagerForChainRun] = None,
+    ) -> Dict[str, str]:
+        question = inputs["question"]
+
+        if self.strategy == "never" or (self.strategy == "heuristic" and is_self_contained(question)):
+            metrics.increment("condense_round_trips_saved")
+            return {"text": question}
+
+        metrics.increment("condense_llm_calls")
+        callbacks = run_manager.get_child() if run_manager else None
+        return {"text": self.llm_chain.predict(
+            question=question,
+            chat_history=inputs["chat_history"],
+            callbacks=callbacks
+        )}
+
+
+def build_conversation_chain(
+    llm: BaseLanguageModel,
+    retriever: BaseRetriever,
+    memory: ConversationBufferMemory,
+    prompt: PromptTemplate,
+    condense_llm: Optional[BaseLanguageModel] = None,
+    strategy: str = CONDENSE_STRATEGY,
+    context_token_budget: int = CONTEXT_TOKEN_BUDGET,
+) -> ConversationalRetrievalChain:
+    """
+    Build the chat chain, equivalent to ConversationalRetrievalChain.from_llm
+    but with a configurable question condensation step
+
+    Args:
+        llm (BaseLanguageModel): Model that writes the answer
+        retriever (BaseRetriever): Retriever for the chatbot's documents
+        memory (ConversationBufferMemory): Conversation memory
+        prompt (PromptTemplate): Prompt combining context, history and question
+        condense_llm (BaseLanguageModel, optional): Model for rewriting
+            questions, defaults to llm
+        strategy (str, optional): One of CONDENSE_STRATEGIES
+        context_token_budget (int, optional): Maximum estimated tokens of
+            retrieved context pasted into the prompt
+
+    Returns:
+        ConversationalRetrievalChain: The chat chain
+    """
+    if strategy not in CONDENSE_STRATEGIES:
+        raise ValueError(f"Unknown condense strategy: {strategy}")
+
+    question_generator = CondenseQuestionChain(
+        llm_chain=LLMChain(
+            llm=condense_llm or llm,
+            prompt=CONDENSE_QUESTION_PROMPT,
+            verbose=True
+        ),
+        strategy=strategy
+    )
+
+    return ConversationalRetrievalChain(
+        # Merge, deduplicate and budget the chunks before they reach the prompt
+        retriever=ContextPackingRetriever(base_retriever=retriever, token_budget=context_token_budget),
+        combine_docs_chain=load_qa_chain(llm, chain_type="stuff", verbose=True, prompt=prompt),
+        question_generator=question_generator,
+        memory=memory,
+        verbose=True,
+        return_source_documents=False
+    )
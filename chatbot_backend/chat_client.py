@@ -1,34 +1,112 @@
 from groq import Groq
-from typing import Any, List, Mapping, Optional, Dict
+from typing import Any, Iterator, List, Mapping, Optional, Dict
 from pydantic import Field, BaseModel  # Updated import
+from langchain_core.callbacks import BaseCallbackHandler, CallbackManagerForLLMRun
 from langchain_core.language_models.llms import LLM
+from langchain_core.outputs import GenerationChunk
+from scheduler_utils import llm_scheduler
+import asyncio
 
 
 
 class GroqLLM(LLM, BaseModel):
     groq_api_key: str = Field(..., description="Groq API Key")
     model_name: str = Field(default="llama-3.3-70b-versatile", description="Model name to use")
+    streaming: bool = Field(default=False, description="Stream tokens to the callbacks as they arrive")
+    priority: int = Field(default=0, description="Scheduling priority, lower values are served first")
     client: Optional[Any] = None
 
     def __init__(self, **data):
         super().__init__(**data)
-        self.client = Groq(api_key=self.groq_api_key)
+        # llm_scheduler owns retries and backoff, the SDK would retry inside each attempt
+        self.client = Groq(api_key=self.groq_api_key, max_retries=0)
     
     @property
     def _llm_type(self) -> str:
         return "groq"
 
-    def _call(self, prompt: str, stop: Optional[List[str]] = None, **kwargs: Any) -> str:
-        completion = self.client.chat.completions.create(
+    def _call(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any
+    ) -> str:
+        if self.streaming:
+            # Streamed answers go to one caller's callbacks and cannot be shared
+            return llm_scheduler.submit(
+                lambda: self._collect_stream(prompt, stop, run_manager, **kwargs),
+                priority=self.priority
+            )
+        
+        def complete() -> str:
+            completion = self.client.chat.completions.create(
+                messages=[{"role": "user", "content": prompt}],
+                model=self.model_name,
+                **kwargs
+            )
+            return completion.choices[0].message.content
+        
+        # Identical prompts in flight at the same time share one upstream call
+        key = (self.model_name, prompt, repr(sorted(kwargs.items())))
+        return llm_scheduler.submit(complete, key=key, priority=self.priority)
+    
+    def _collect_stream(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any
+    ) -> str:
+        text = ""
+        try:
+            for chunk in self._stream(prompt, stop, run_manager, **kwargs):
+                text += chunk.text
+        except Exception as e:
+            if text:
+                # Tokens already reached the client, a retry would repeat them
+                raise RuntimeError(f"LLM stream interrupted: {str(e)}") from e
+            raise
+        return text
+    
+    def _stream(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any
+    ) -> Iterator[GenerationChunk]:
+        stream = self.client.chat.completions.create(
             messages=[{"role": "user", "content": prompt}],
             model=self.model_name,
+            stream=True,
             **kwargs
         )
-        return completion.choices[0].message.content
+        for chunk in stream:
+            token = chunk.choices[0].delta.content if chunk.choices else None
+            if not token:
+                continue
+            generation = GenerationChunk(text=token)
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=generation)
+            yield generation
     
     @property
     def _identifying_params(self) -> Dict[str, Any]:
         """Get the identifying parameters."""
         return {
             "model_name": self.model_name
-        }
\ No newline at end of file
+        }
+
+
+class QueueCallbackHandler(BaseCallbackHandler):
+    """
+    Puts every streamed token on an event loop's queue, to be relayed to the
+    client. Tokens arrive on the chain's thread, so they are handed to the loop.
+    """
+    def __init__(self, token_queue: asyncio.Queue, loop: asyncio.AbstractEventLoop):
+        self.token_queue = token_queue
+        self.loop = loop
+    
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        self.loop.call_soon_threadsafe(self.token_queue.put_nowait, token)
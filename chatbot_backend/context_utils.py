@@ -0,0 +1,167 @@
+from typing import Dict, List, Tuple
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from metrics_utils import metrics
+import os
+import re
+
+
+# Upper bound for the retrieved text pasted into the prompt's {context}
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+# Chunks whose word trigrams overlap at least this much count as duplicates
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", "0.8"))
+# Chunks of a source at most this many characters apart are joined
+_ADJACENT_GAP = 2
+# Rough size of a token in characters, good enough for budgeting
+_CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Approximate the number of tokens in a text
+
+    Args:
+        text (str): Text to measure
+
+    Returns:
+        int: Estimated token count
+    """
+    return (len(text) + _CHARS_PER_TOKEN - 1) // _CHARS_PER_TOKEN
+
+
+def _merge_adjacent(ranked_docs: List[Tuple[int, Document]]) -> List[Tuple[int, Document]]:
+    """
+    Join chunks from the same source whose character ranges overlap or touch.
+    A merged block keeps the best rank of its chunks.
+    """
+    by_source: Dict[Tuple, List[Tuple[int, Document]]] = {}
+    blocks = []
+    for rank, doc in ranked_docs:
+        # The splitter records -1 when it cannot locate a chunk in its source
+        if doc.metadata.get("start_index", -1) >= 0 and "document_id" in doc.metadata:
+            source = (
+                doc.metadata.get("collection"),
+                doc.metadata["document_id"],
+                doc.metadata.get("source"),
+                doc.metadata.get("page")
+            )
+            by_source.setdefault(source, []).append((rank, doc))
+        else:
+            # Chunks indexed before positions were recorded, or never found in
+            # their source, cannot be placed
+            blocks.append((rank, doc))
+
+    for chunks in by_source.values():
+        chunks.sort(key=lambda chunk: chunk[1].metadata["start_index"])
+        rank, first = chunks[0]
+        text = first.page_content
+        # Offset in the source where text ends, the text itself is not measured
+        end = first.metadata["start_index"] + len(text)
+        metadata = dict(first.metadata)
+
+        for next_rank, doc in chunks[1:]:
+            next_start = doc.metadata["start_index"]
+            if next_start <= end + _ADJACENT_GAP:
+                overlap = end - next_start
+                if overlap >= 0:
+                    text += doc.page_content[overlap:]
+                else:
+                    # The splitter only drops its "\n\n" separator between chunks
+                    text += "\n" * -overlap + doc.page_content
+                end = max(end, next_start + len(doc.page_content))
+                rank = min(rank, next_rank)
+            else:
+                blocks.append((rank, Document(page_content=text, metadata=metadata)))
+                rank, text, metadata = next_rank, doc.page_content, dict(doc.metadata)
+                end = next_start + len(text)
+
+        blocks.append((rank, Document(page_content=text, metadata=metadata)))
+
+    blocks.sort(key=lambda block: block[0])
+    return blocks
+
+
+def _shingles(text: str) -> set:
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < 3:
+        return {tuple(words)}
+    return {tuple(words[i:i + 3]) for i in range(len(words) - 2)}
+
+
+def _drop_near_duplicates(blocks: List[Tuple[int, Document]], threshold: float) -> List[Tuple[int, Document]]:
+    """
+    Keep the best ranked of any blocks that repeat essentially the same text
+    """
+    kept = []
+    kept_shingles = []
+    for rank, doc in blocks:
+        shingles = _shingles(doc.page_content)
+        duplicate = any(
+            len(shingles & other) / max(1, len(shingles | other)) >= threshold
+            for other in kept_shingles
+        )
+        if not duplicate:
+            kept.append((rank, doc))
+            kept_shingles.append(shingles)
+    return kept
+
+
+def pack_context(
+    docs: List[Document],
+    token_budget: int = CONTEXT_TOKEN_BUDGET,
+    duplicate_threshold: float = NEAR_DUPLICATE_THRESHOLD,
+) -> List[Document]:
+    """
+    Assemble retrieved chunks into the context passed to the prompt: merge
+    adjacent and overlapping chunks of the same source, drop near-duplicates
+    and keep the most relevant text within a token budget.
+
+    Args:
+        docs (List[Document]): Retrieved chunks, most relevant first
+        token_budget (int, optional): Maximum estimated tokens of context
+        duplicate_threshold (float, optional): Trigram similarity from which
+            two blocks count as duplicates
+
+    Returns:
+        List[Document]: Context blocks, most relevant first
+    """
+    blocks = _merge_adjacent(list(enumerate(docs)))
+    blocks = _drop_near_duplicates(blocks, duplicate_threshold)
+
+    packed = []
+    remaining = token_budget
+    for _, doc in blocks:
+        tokens = estimate_tokens(doc.page_content)
+        if tokens <= remaining:
+            packed.append(doc)
+            remaining -= tokens
+        elif not packed:
+            # Never send an empty context, cut the best block to the budget
+            text = doc.page_content[:remaining * _CHARS_PER_TOKEN]
+            packed.append(Document(page_content=text, metadata=doc.metadata))
+            remaining = 0
+        if remaining <= 0:
+            break
+
+    raw_tokens = sum(estimate_tokens(doc.page_content) for doc in docs)
+    packed_tokens = sum(estimate_tokens(doc.page_content) for doc in packed)
+    metrics.increment("context_tokens_packed", packed_tokens)
+    metrics.increment("context_tokens_saved", max(0, raw_tokens - packed_tokens))
+    return packed
+
+
+class ContextPackingRetriever(BaseRetriever):
+    """
+    Retriever that packs the results of another retriever with pack_context
+    """
+
+    base_retriever: BaseRetriever
+    token_budget: int = CONTEXT_TOKEN_BUDGET
+    duplicate_threshold: float = NEAR_DUPLICATE_THRESHOLD
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        docs = self.base_retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+        return pack_context(docs, self.token_budget, self.duplicate_threshold)
@@ -4,10 +4,12 @@ from contextlib import contextmanager
 
 
 DATABASE_URL = "chatbot_db.sqlite3"
+# Several workers share the database, wait for their write locks instead of failing
+DATABASE_BUSY_TIMEOUT = 30
 
 @contextmanager
 def get_db():
-    conn = sqlite3.connect(DATABASE_URL)
+    conn = sqlite3.connect(DATABASE_URL, timeout=DATABASE_BUSY_TIMEOUT)
     conn.row_factory = sqlite3.Row
     try:
         yield conn
@@ -16,6 +18,8 @@ def get_db():
 
 def init_db():
     with get_db() as conn:
+        # WAL lets readers in other workers proceed while one worker writes
+        conn.execute("PRAGMA journal_mode=WAL")
         conn.executescript("""
             CREATE TABLE IF NOT EXISTS users (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -35,6 +39,39 @@ def init_db():
                 FOREIGN KEY(user_id) REFERENCES users(id)
             );
             
+            CREATE TABLE IF NOT EXISTS documents (
+                id TEXT PRIMARY KEY,
+                chatbot_id INTEGER NOT NULL,
+                filename TEXT NOT NULL,
+                chunk_count INTEGER NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY(chatbot_id) REFERENCES chatbots(id)
+            );
+            
+            CREATE TABLE IF NOT EXISTS chatbot_collections (
+                chatbot_id INTEGER NOT NULL,
+                collection_name TEXT NOT NULL,
+                PRIMARY KEY(chatbot_id, collection_name),
+                FOREIGN KEY(chatbot_id) REFERENCES chatbots(id)
+            );
+            
+            CREATE TABLE IF NOT EXISTS conversation_memory (
+                user_id TEXT NOT NULL,
+                chatbot_id TEXT NOT NULL,
+                messages TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY(user_id, chatbot_id)
+            );
+            
+            CREATE TABLE IF NOT EXISTS collection_access (
+                collection_name TEXT PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                chatbot_name TEXT NOT NULL,
+                last_used REAL NOT NULL,
+                request_rate REAL NOT NULL
+            );
+            
             CREATE TABLE IF NOT EXISTS embeddings (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 chatbot_id INTEGER NOT NULL,
@@ -1,109 +1,752 @@
-from langchain.text_splitter import CharacterTextSplitter
 from fastapi import HTTPException
 from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.document_loaders import TextLoader, PDFMinerLoader
 from langchain_community.vectorstores import FAISS  # Use FAISS instead of Chroma
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_core.documents import Document
+from retrieval_utils import MultiCollectionRetriever
+from parse_utils import load_document, parse_file, split_document, text_splitter
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+import faiss
+import fcntl
+import multiprocessing
+import numpy as np
 import os
+import pickle
+import shutil
+import tempfile
+import threading
+import uuid
+import zlib
 from huggingface_hub import login
 
 login(token="you huggin face access token")
 
+# Attempts at loading an index while another worker is replacing it
+INDEX_LOAD_RETRIES = 3
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+# Collections with at most this many chunks share an index with other small
+# collections instead of a file pair of their own; 0 gives every collection
+# its own index
+SHARED_INDEX_THRESHOLD = int(os.getenv("SHARED_INDEX_THRESHOLD", "0"))
+# Shared indexes small collections are spread over, so a write rewrites one
+# shard rather than all of them. Fixed once small collections are stored.
+SHARED_INDEX_SHARDS = int(os.getenv("SHARED_INDEX_SHARDS", "64"))
+# Cannot clash with collection_name_for(), usernames are never empty
+SHARED_SHARD_PREFIX = "_shared_small_collections_"
+# Processes shared by all uploads for parsing and splitting files in parallel;
+# parsers such as PDFMiner are pure Python and would hold the GIL in threads
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", "4"))
+
+_parse_executor: Optional[ProcessPoolExecutor] = None
+_parse_executor_guard = threading.Lock()
+
+
+def _get_parse_executor() -> ProcessPoolExecutor:
+    global _parse_executor
+    with _parse_executor_guard:
+        if _parse_executor is None:
+            # Spawned rather than forked, so workers start clean instead of
+            # inheriting the embedding model and the threads of this process
+            _parse_executor = ProcessPoolExecutor(
+                max_workers=PARSE_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _parse_executor
+
+
+def _discard_parse_executor(executor: ProcessPoolExecutor):
+    # A worker died (e.g. out of memory on a huge PDF), start a new pool next time
+    global _parse_executor
+    with _parse_executor_guard:
+        if _parse_executor is executor:
+            _parse_executor = None
+    executor.shutdown(wait=False)
+
+
+def collection_name_for(username: str, chatbot_name: str) -> str:
+    """
+    Name of the FAISS collection backing a user's chatbot
+    
+    Args:
+        username (str): Username of the chatbot owner
+        chatbot_name (str): Name of the chatbot
+    
+    Returns:
+        str: Collection name, also used as the index file name
+    """
+    return f"{username}_{chatbot_name}".replace(" ", "_").lower()
+
 class DocumentProcessor:
     def __init__(self):
-        self.embedding_model = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-        self.text_splitter = CharacterTextSplitter(chunk_size=100, chunk_overlap=20)
+        self.embedding_model = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+        self.text_splitter = text_splitter
         self.vec_database_path = "vec-database"
         
+        # Loaded vector stores. They are never modified once published: writers
+        # change a private copy, persist it and then swap it in, so searches
+        # run without waiting for writes
+        self._vectorstores: Dict[str, FAISS] = {}
+        # Identity of the index file each store was loaded from, so writes by
+        # other workers are noticed and the store is reloaded
+        self._file_stamps: Dict[str, Tuple[int, int, int]] = {}
+        self.shared_index_threshold = SHARED_INDEX_THRESHOLD
+        # Positions of each small collection's chunks in its shard, together
+        # with the shard store they were computed for
+        self._shard_positions: Dict[str, Tuple[FAISS, Dict[str, np.ndarray]]] = {}
+        # Writers hold a collection's lock for the whole write, loads hold its
+        # load lock only while reading the files
+        self._locks: Dict[str, threading.RLock] = {}
+        self._load_locks: Dict[str, threading.RLock] = {}
+        self._locks_guard = threading.Lock()
+        # Collections whose file lock is held by the thread holding their lock
+        self._file_locked: set = set()
+        
         # Ensure vector database directory exists
         os.makedirs(self.vec_database_path, exist_ok=True)
     
     def load_document(self, file_path: str):
-        if file_path.endswith('.txt'):
-            loader = TextLoader(file_path)
-        elif file_path.endswith('.pdf'):
-            loader = PDFMinerLoader(file_path)
-        else:
-            raise ValueError("Unsupported file format")
-        return loader.load()
-    
-    def process_document(self, file_path: str, username: str, chatbot_name: str):
-        # Load and split documents
-        documents = self.load_document(file_path)
-        texts = self.text_splitter.split_documents(documents)
-        
-        # Create or load FAISS vector store
-        collection_name = f"{username}_{chatbot_name}".replace(" ", "_").lower()
-        faiss_index_path = os.path.join(self.vec_database_path, f"{collection_name}.faiss")
-        
-        if os.path.exists(faiss_index_path):
-            # Load existing FAISS index
-            vectorstore = FAISS.load_local(
-                folder_path=self.vec_database_path,
-                embeddings=self.embedding_model,
-                index_name=collection_name
-            )
-            print(f"Existing FAISS index {collection_name} found. Adding new documents.")
-        else:
-            # Create new FAISS index
-            vectorstore = FAISS.from_documents(
-                documents=texts,
-                embedding=self.embedding_model
-            )
-            print(f"Created new FAISS index {collection_name}")
+        return load_document(file_path)
+    
+    def _lock(self, locks: Dict[str, threading.RLock], collection_name: str) -> threading.RLock:
+        with self._locks_guard:
+            if collection_name not in locks:
+                locks[collection_name] = threading.RLock()
+            return locks[collection_name]
+    
+    def _collection_lock(self, collection_name: str) -> threading.RLock:
+        return self._lock(self._locks, collection_name)
+    
+    def _load_lock(self, collection_name: str) -> threading.RLock:
+        return self._lock(self._load_locks, collection_name)
+    
+    @contextmanager
+    def _write_lock(self, collection_name: str):
+        """
+        Serialize writes to a collection across threads and worker processes.
+        Writers reload, modify and save the index under this lock, so a save
+        by one worker never replaces another worker's write.
+        """
+        with self._collection_lock(collection_name):
+            if collection_name in self._file_locked:
+                # Already held further up this thread's stack
+                yield
+                return
+            
+            lock_path = os.path.join(self.vec_database_path, f"{collection_name}.lock")
+            with open(lock_path, "w") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                self._file_locked.add(collection_name)
+                try:
+                    yield
+                finally:
+                    self._file_locked.discard(collection_name)
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+    
+    def _index_paths(self, collection_name: str) -> Tuple[str, str]:
+        base = os.path.join(self.vec_database_path, collection_name)
+        return f"{base}.faiss", f"{base}.pkl"
+    
+    def _file_stamp(self, collection_name: str) -> Optional[Tuple[int, int, int]]:
+        """
+        Identity of a collection's index file. Saves rename a new file over the
+        old one, so the inode changes whenever any worker writes the collection.
+        """
+        faiss_index_path, _ = self._index_paths(collection_name)
+        try:
+            stat = os.stat(faiss_index_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+    
+    def _load_vectorstore(self, collection_name: str) -> Optional[FAISS]:
+        """
+        Get the vector store of a collection, loading it from disk on first use
+        or when another worker has written it since it was loaded
         
-        # Add new documents to the vector store
-        vectorstore.add_documents(texts)
+        Args:
+            collection_name (str): Name of the collection
         
-        # Save the updated FAISS index to disk
-        vectorstore.save_local(
-            folder_path=self.vec_database_path,
-            index_name=collection_name
+        Returns:
+            Optional[FAISS]: The vector store, or None if the collection does not exist
+        """
+        with self._load_lock(collection_name):
+            stamp = self._file_stamp(collection_name)
+            if stamp is None:
+                self._vectorstores.pop(collection_name, None)
+                self._file_stamps.pop(collection_name, None)
+                return None
+            
+            if collection_name in self._vectorstores and self._file_stamps.get(collection_name) == stamp:
+                return self._vectorstores[collection_name]
+            
+            for _ in range(INDEX_LOAD_RETRIES):
+                vectorstore = FAISS.load_local(
+                    folder_path=self.vec_database_path,
+                    embeddings=self.embedding_model,
+                    index_name=collection_name,
+                    allow_dangerous_deserialization=True
+                )
+                # A concurrent save may have swapped the files halfway through the load
+                new_stamp = self._file_stamp(collection_name)
+                if new_stamp == stamp and vectorstore.index.ntotal == len(vectorstore.index_to_docstore_id):
+                    break
+                stamp = new_stamp
+            
+            self._vectorstores[collection_name] = vectorstore
+            self._file_stamps[collection_name] = stamp
+            return vectorstore
+    
+    def _working_copy(self, collection_name: str) -> Optional[FAISS]:
+        """
+        Private copy of a collection's vector store for a writer to modify.
+        Callers must hold the collection's write lock.
+        """
+        vectorstore = self._load_vectorstore(collection_name)
+        if vectorstore is None:
+            return None
+        
+        return FAISS(
+            embedding_function=self.embedding_model,
+            index=faiss.clone_index(vectorstore.index),
+            docstore=InMemoryDocstore(dict(vectorstore.docstore._dict)),
+            index_to_docstore_id=dict(vectorstore.index_to_docstore_id)
         )
+    
+    def _save_vectorstore(self, collection_name: str, vectorstore: FAISS):
+        """
+        Persist a vector store atomically: write to a temporary directory on the
+        same filesystem, then rename over the live files so readers never see a
+        partially written index.
         
-        return collection_name
-
-    def retrieve_collection(self, username: str, chatbot_name: str):
+        Args:
+            collection_name (str): Name of the collection
+            vectorstore (FAISS): Vector store to persist
+        """
+        tmp_dir = tempfile.mkdtemp(dir=self.vec_database_path)
+        try:
+            vectorstore.save_local(folder_path=tmp_dir, index_name=collection_name)
+            faiss_index_path, pkl_path = self._index_paths(collection_name)
+            # Docstore first, so a reader that sees the new index also sees its chunks
+            os.replace(os.path.join(tmp_dir, f"{collection_name}.pkl"), pkl_path)
+            os.replace(os.path.join(tmp_dir, f"{collection_name}.faiss"), faiss_index_path)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        
+        # The written store replaces the published one, searches that already
+        # hold the old store finish on it
+        with self._load_lock(collection_name):
+            self._vectorstores[collection_name] = vectorstore
+            self._file_stamps[collection_name] = self._file_stamp(collection_name)
+    
+    def _has_dedicated_index(self, collection_name: str) -> bool:
+        return self._file_stamp(collection_name) is not None
+    
+    @staticmethod
+    def _shard_for(collection_name: str) -> str:
+        """
+        Shared index holding a small collection, stable across processes
+        """
+        shard = zlib.crc32(collection_name.encode("utf-8")) % SHARED_INDEX_SHARDS
+        return f"{SHARED_SHARD_PREFIX}{shard:03d}"
+    
+    def _shard_positions_for(self, shard_name: str) -> Tuple[Optional[FAISS], Dict[str, np.ndarray]]:
+        """
+        A shard's store and the positions of each small collection's chunks in it.
+        Only recomputed after the shard was written, which costs the shard's size.
         """
-        Retrieve a FAISS retriever for a specific collection
+        shard = self._load_vectorstore(shard_name)
+        if shard is None:
+            return None, {}
+        
+        cached = self._shard_positions.get(shard_name)
+        if cached is not None and cached[0] is shard:
+            return cached
+        
+        positions: Dict[str, List[int]] = {}
+        for position, docstore_id in shard.index_to_docstore_id.items():
+            doc = shard.docstore.search(docstore_id)
+            if isinstance(doc, Document):
+                positions.setdefault(doc.metadata.get("collection"), []).append(position)
+        cached = (shard, {
+            name: np.array(sorted(collection_positions), dtype=np.int64)
+            for name, collection_positions in positions.items()
+        })
+        self._shard_positions[shard_name] = cached
+        return cached
+    
+    def _shared_chunks(self, collection_name: str) -> Tuple[Optional[FAISS], Optional[np.ndarray]]:
+        """
+        The shard store holding a small collection and the positions of its chunks
+        """
+        shard, positions = self._shard_positions_for(self._shard_for(collection_name))
+        return shard, positions.get(collection_name)
+    
+    def collection_exists(self, collection_name: str) -> bool:
+        """
+        Check whether a collection has an index of its own or chunks in a shard
         
         Args:
-            username (str): Username of the chatbot owner
-            chatbot_name (str): Name of the chatbot
+            collection_name (str): Name of the collection
         
         Returns:
-            FAISSRetriever: A retriever for the specified collection
+            bool: True if the collection exists
         """
-        # Generate collection name
-        print("inside fiass 1")
-        collection_name = f"{username}_{chatbot_name}".replace(" ", "_").lower()
-        faiss_index_path = os.path.join(self.vec_database_path, f"{collection_name}.faiss")
-        print("inside fiass 2")
+        if self._has_dedicated_index(collection_name):
+            return True
+        return self._shared_chunks(collection_name)[1] is not None
+    
+    def split_document(self, file_path: str, document_id: str) -> List[Document]:
+        """
+        Load a file and split it into chunks tagged with their source document
         
-        try:
-            # Load FAISS index
-            vectorstore = FAISS.load_local(
-                folder_path=self.vec_database_path,
-                embeddings=self.embedding_model,
-                index_name=collection_name,
-                allow_dangerous_deserialization=True
+        Args:
+            file_path (str): Path of the file to load
+            document_id (str): Identifier of the source document
+        
+        Returns:
+            List[Document]: Chunks carrying a "document_id" metadata entry
+        """
+        return split_document(file_path, document_id)
+    
+    @staticmethod
+    def chunk_ids(document_id: str, chunk_count: int) -> List[str]:
+        """
+        Docstore ids of a document's chunks, derived from the document id so
+        removal needs no extra bookkeeping
+        """
+        return [f"{document_id}-{i}" for i in range(chunk_count)]
+    
+    def add_document(self, file_path: str, collection_name: str, document_id: str) -> int:
+        """
+        Embed a document and append its chunks to a collection, creating the
+        collection if needed. Only the new chunks are embedded and added to the
+        in-memory index, which is then persisted.
+        
+        Args:
+            file_path (str): Path of the file to add
+            collection_name (str): Name of the collection
+            document_id (str): Identifier of the document
+        
+        Returns:
+            int: Number of chunks added
+        """
+        result = self.add_documents([(file_path, document_id)], collection_name)[document_id]
+        if isinstance(result, Exception):
+            raise result
+        return result
+    
+    def add_documents(self, files: Sequence[Tuple[str, str]], collection_name: str) -> Dict[str, Union[int, Exception]]:
+        """
+        Add several documents to a collection in one pass: the files are parsed
+        in parallel worker processes, the chunks of all of them are embedded
+        in one batch here and the index is written once. A file that cannot be parsed is left out
+        without failing the others.
+        
+        Args:
+            files (Sequence[Tuple[str, str]]): Path and document id of every file
+            collection_name (str): Name of the collection
+        
+        Returns:
+            Dict[str, Union[int, Exception]]: Number of chunks added for every
+            document id, or the error that kept the document out
+        """
+        results: Dict[str, Union[int, Exception]] = {}
+        texts: List[Document] = []
+        ids: List[str] = []
+        executor = _get_parse_executor()
+        futures = [executor.submit(parse_file, file_path, document_id) for file_path, document_id in files]
+        for (_, document_id), future in zip(files, futures):
+            try:
+                parsed, error = future.result()
+            except BrokenProcessPool:
+                _discard_parse_executor(executor)
+                parsed, error = None, "Parsing worker stopped unexpectedly"
+            if error is not None:
+                results[document_id] = ValueError(error)
+                continue
+            results[document_id] = len(parsed)
+            texts.extend(parsed)
+            ids.extend(self.chunk_ids(document_id, len(parsed)))
+        
+        if texts:
+            embeddings = self.embedding_model.embed_documents([text.page_content for text in texts])
+            self._add_chunks(collection_name, texts, embeddings, ids)
+        return results
+    
+    def _add_chunks(self, collection_name: str, texts: List[Document], embeddings: List[List[float]], ids: List[str]):
+        """
+        Add embedded chunks to a collection, in its shard while the collection
+        stays within the threshold, in its own index otherwise
+        """
+        with self._write_lock(collection_name):
+            if self.shared_index_threshold > 0 and not self._has_dedicated_index(collection_name):
+                shard_name = self._shard_for(collection_name)
+                with self._write_lock(shard_name):
+                    _, positions = self._shared_chunks(collection_name)
+                    shared_count = 0 if positions is None else len(positions)
+                    if shared_count + len(texts) <= self.shared_index_threshold:
+                        tagged = [
+                            Document(page_content=text.page_content, metadata={**text.metadata, "collection": collection_name})
+                            for text in texts
+                        ]
+                        self._add_to_index(shard_name, tagged, embeddings, ids)
+                        return
+                    if shared_count:
+                        self._promote(collection_name, texts, embeddings, ids)
+                        return
+            
+            self._add_to_index(collection_name, texts, embeddings, ids)
+    
+    def _add_to_index(self, index_name: str, texts: List[Document], embeddings: List[List[float]], ids: List[str]):
+        text_embeddings = list(zip([text.page_content for text in texts], embeddings))
+        metadatas = [text.metadata for text in texts]
+        
+        vectorstore = self._working_copy(index_name)
+        if vectorstore is None:
+            vectorstore = FAISS.from_embeddings(
+                text_embeddings,
+                self.embedding_model,
+                metadatas=metadatas,
+                ids=ids
             )
+            print(f"Created new FAISS index {index_name}")
+        else:
+            vectorstore.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+            print(f"Existing FAISS index {index_name} found. Adding new documents.")
+        
+        self._save_vectorstore(index_name, vectorstore)
+    
+    def _promote(self, collection_name: str, texts: List[Document], embeddings: List[List[float]], ids: List[str]):
+        """
+        Move a collection that outgrew the threshold from its shard to an index
+        of its own, together with the chunks being added. Callers must hold the
+        collection's and the shard's write locks.
+        """
+        shard_name = self._shard_for(collection_name)
+        shard, positions = self._shared_chunks(collection_name)
+        
+        moved_ids = [shard.index_to_docstore_id[int(position)] for position in positions]
+        moved_texts = []
+        for docstore_id in moved_ids:
+            doc = shard.docstore.search(docstore_id)
+            metadata = {key: value for key, value in doc.metadata.items() if key != "collection"}
+            moved_texts.append(Document(page_content=doc.page_content, metadata=metadata))
+        # The stored vectors are reused, nothing is embedded again
+        moved_embeddings = shard.index.reconstruct_batch(positions).tolist()
+        
+        # Write the new index before removing the chunks from the shard, a
+        # dedicated index takes precedence if this is interrupted in between
+        self._add_to_index(collection_name, moved_texts + texts, moved_embeddings + embeddings, moved_ids + ids)
+        shard = self._working_copy(shard_name)
+        shard.delete(moved_ids)
+        self._save_vectorstore(shard_name, shard)
+        print(f"Promoted {collection_name} from {shard_name} to its own index")
+    
+    def delete_document(self, collection_name: str, document_id: str) -> int:
+        """
+        Remove every chunk of a document from a collection
+        
+        Args:
+            collection_name (str): Name of the collection
+            document_id (str): Identifier of the document
+        
+        Returns:
+            int: Number of chunks removed
+        """
+        with self._write_lock(collection_name):
+            if self._has_dedicated_index(collection_name):
+                return self._delete_chunks(collection_name, document_id)
             
-            print("inside fiass 3")
+            shard_name = self._shard_for(collection_name)
+            with self._write_lock(shard_name):
+                if self._shared_chunks(collection_name)[1] is None:
+                    return 0
+                # Document ids are unique, so this only touches the collection's chunks
+                return self._delete_chunks(shard_name, document_id)
+    
+    def _delete_chunks(self, index_name: str, document_id: str) -> int:
+        prefix = f"{document_id}-"
+        vectorstore = self._working_copy(index_name)
+        if vectorstore is None:
+            return 0
+        
+        ids = [
+            docstore_id for docstore_id in vectorstore.index_to_docstore_id.values()
+            if docstore_id.startswith(prefix)
+        ]
+        if not ids:
+            return 0
+        
+        # Maps the docstore ids to FAISS positions and removes only those vectors
+        vectorstore.delete(ids)
+        self._save_vectorstore(index_name, vectorstore)
+        return len(ids)
+    
+    def export_collection(self, collection_name: str, index_path: str) -> List[dict]:
+        """
+        Write the raw FAISS index of a collection and return its chunks
+        
+        Args:
+            collection_name (str): Name of the collection
+            index_path (str): File the index is written to
+        
+        Returns:
+            List[dict]: id, page_content and metadata of every chunk, in index order
+        """
+        if not self._has_dedicated_index(collection_name):
+            return self._export_shared_collection(collection_name, index_path)
+        
+        vectorstore = self._load_vectorstore(collection_name)
+        if vectorstore is None:
+            raise FileNotFoundError(f"No index found for collection {collection_name}")
+        
+        faiss.write_index(vectorstore.index, index_path)
+        chunks = []
+        for i in range(vectorstore.index.ntotal):
+            docstore_id = vectorstore.index_to_docstore_id[i]
+            doc = vectorstore.docstore.search(docstore_id)
+            chunks.append({
+                "id": docstore_id,
+                "page_content": doc.page_content,
+                "metadata": doc.metadata
+            })
+        return chunks
+    
+    def _export_shared_collection(self, collection_name: str, index_path: str) -> List[dict]:
+        shard, positions = self._shared_chunks(collection_name)
+        if positions is None:
+            raise FileNotFoundError(f"No index found for collection {collection_name}")
+        
+        # Snapshots always carry an index of their own, built from the stored vectors
+        index = faiss.IndexFlatL2(shard.index.d)
+        index.add(shard.index.reconstruct_batch(positions))
+        faiss.write_index(index, index_path)
+        
+        chunks = []
+        for position in positions:
+            docstore_id = shard.index_to_docstore_id[int(position)]
+            doc = shard.docstore.search(docstore_id)
+            chunks.append({
+                "id": docstore_id,
+                "page_content": doc.page_content,
+                "metadata": {key: value for key, value in doc.metadata.items() if key != "collection"}
+            })
+        return chunks
+    
+    def import_collection(self, collection_name: str, index_path: str, chunks: List[dict]):
+        """
+        Install a raw FAISS index and its chunks as a new collection. The index
+        file is moved into place and read as is, so the collection serves
+        queries without re-embedding or unpickling vectors.
+        
+        Args:
+            collection_name (str): Name of the new collection
+            index_path (str): Raw FAISS index file, consumed by the import
+            chunks (List[dict]): id, page_content and metadata of every chunk, in index order
+        """
+        docstore = InMemoryDocstore({
+            chunk["id"]: Document(page_content=chunk["page_content"], metadata=chunk["metadata"])
+            for chunk in chunks
+        })
+        index_to_docstore_id = {i: chunk["id"] for i, chunk in enumerate(chunks)}
+        
+        with self._write_lock(collection_name):
+            if self.collection_exists(collection_name):
+                raise FileExistsError(f"Collection {collection_name} already exists")
             
+            faiss_index_path, pkl_path = self._index_paths(collection_name)
+            staged_index_path = os.path.join(self.vec_database_path, f".{uuid.uuid4()}.faiss")
+            shutil.move(index_path, staged_index_path)
+            try:
+                index = faiss.read_index(staged_index_path)
+                if index.ntotal != len(chunks):
+                    raise ValueError("Index and chunks do not match")
+                
+                # Same files as FAISS.save_local writes, docstore first as in _save_vectorstore
+                fd, staged_pkl_path = tempfile.mkstemp(dir=self.vec_database_path)
+                with os.fdopen(fd, "wb") as f:
+                    pickle.dump((docstore, index_to_docstore_id), f)
+                os.replace(staged_pkl_path, pkl_path)
+                os.replace(staged_index_path, faiss_index_path)
+            finally:
+                if os.path.exists(staged_index_path):
+                    os.remove(staged_index_path)
             
-            # Create and return a retriever
-            return vectorstore.as_retriever(
-                search_type="mmr",  # Maximum Marginal Relevance retrieval
-                search_kwargs={
-                    "k": 5,  # Number of documents to retrieve
-                    "fetch_k": 10  # Number of documents to consider before filtering
-                }
+            with self._load_lock(collection_name):
+                self._vectorstores[collection_name] = FAISS(
+                    embedding_function=self.embedding_model,
+                    index=index,
+                    docstore=docstore,
+                    index_to_docstore_id=index_to_docstore_id
+                )
+                self._file_stamps[collection_name] = self._file_stamp(collection_name)
+    
+    def process_document(self, file_path: str, username: str, chatbot_name: str, document_id: Optional[str] = None):
+        """
+        Add a document to the collection of a user's chatbot
+        
+        Args:
+            file_path (str): Path of the file to add
+            username (str): Username of the chatbot owner
+            chatbot_name (str): Name of the chatbot
+            document_id (str, optional): Identifier of the document
+        
+        Returns:
+            str: Name of the collection
+        """
+        collection_name = collection_name_for(username, chatbot_name)
+        self.add_document(file_path, collection_name, document_id or str(uuid.uuid4()))
+        return collection_name
+
+    def index_name_for(self, collection_name: str) -> str:
+        """
+        Index a collection is stored in, its own or the shard it shares
+        
+        Args:
+            collection_name (str): Name of the collection
+        
+        Returns:
+            str: Name of the index
+        """
+        if self._has_dedicated_index(collection_name):
+            return collection_name
+        return self._shard_for(collection_name)
+    
+    def collection_size(self, collection_name: str) -> int:
+        """
+        Size of a collection on disk, a proxy for the memory it takes once loaded
+        
+        Args:
+            collection_name (str): Name of the collection
+        
+        Returns:
+            int: Size in bytes, 0 if the collection does not exist
+        """
+        # A small collection is loaded with its whole shard
+        size = 0
+        for path in self._index_paths(self.index_name_for(collection_name)):
+            if os.path.exists(path):
+                size += os.path.getsize(path)
+        return size
+    
+    def preload_collection(self, collection_name: str) -> bool:
+        """
+        Load a collection into memory ahead of its first query
+        
+        Args:
+            collection_name (str): Name of the collection
+        
+        Returns:
+            bool: True if the collection exists and is loaded
+        """
+        if self._has_dedicated_index(collection_name):
+            return self._load_vectorstore(collection_name) is not None
+        # Also indexes the shard by collection, which searches would do otherwise
+        return self._shared_chunks(collection_name)[1] is not None
+    
+    def search_collection(self, collection_name: str, embedding: List[float], fetch_k: int) -> List[Tuple[Document, float, np.ndarray]]:
+        """
+        Find the chunks of a collection nearest to a query embedding
+        
+        Args:
+            collection_name (str): Name of the collection
+            embedding (List[float]): Embedded query
+            fetch_k (int): Number of chunks to return
+        
+        Returns:
+            List[Tuple[Document, float, np.ndarray]]: Chunks tagged with their
+            collection, their relevance score in (0, 1] and their vector
+        """
+        query = np.array([embedding], dtype=np.float32)
+        
+        # Published stores are never modified, so no lock is held while searching
+        if self._has_dedicated_index(collection_name):
+            vectorstore = self._load_vectorstore(collection_name)
+            if vectorstore is None:
+                return []
+            distances, indices = vectorstore.index.search(query, fetch_k)
+            found = indices[0] != -1
+            distances, indices = distances[0][found], indices[0][found]
+            if not len(indices):
+                return []
+            return self._search_results(
+                vectorstore,
+                collection_name,
+                distances,
+                indices,
+                vectorstore.index.reconstruct_batch(indices)
             )
         
-        except Exception as e:
+        shard, positions = self._shared_chunks(collection_name)
+        if positions is None:
+            return []
+        
+        # Score only the collection's own vectors, the rest of the shard is never touched
+        vectors = shard.index.reconstruct_batch(positions)
+        squared_distances = ((vectors - query) ** 2).sum(axis=1)
+        k = min(fetch_k, len(positions))
+        nearest = np.argpartition(squared_distances, k - 1)[:k]
+        nearest = nearest[np.argsort(squared_distances[nearest])]
+        # The vectors fetched for scoring are returned as they are, not read again
+        return self._search_results(
+            shard,
+            collection_name,
+            squared_distances[nearest],
+            positions[nearest],
+            vectors[nearest]
+        )
+    
+    @staticmethod
+    def _search_results(
+        vectorstore: FAISS,
+        collection_name: str,
+        distances: np.ndarray,
+        indices: np.ndarray,
+        vectors: np.ndarray
+    ) -> List[Tuple[Document, float, np.ndarray]]:
+        results = []
+        for distance, i, vector in zip(distances, indices, vectors):
+            doc = vectorstore.docstore.search(vectorstore.index_to_docstore_id[int(i)])
+            if not isinstance(doc, Document):
+                continue
+            # L2 distances are comparable across collections embedded with the
+            # same model; map them to a score where higher is more relevant
+            results.append((
+                Document(page_content=doc.page_content, metadata={**doc.metadata, "collection": collection_name}),
+                1.0 / (1.0 + float(distance)),
+                vector
+            ))
+        return results
+
+    def retrieve_collection(self, username: str, chatbot_name: str, linked_collections: Sequence[str] = ()):
+        """
+        Retrieve a retriever for a chatbot's collection and the collections it links to
+        
+        Args:
+            username (str): Username of the chatbot owner
+            chatbot_name (str): Name of the chatbot
+            linked_collections (Sequence[str], optional): Further collections to search
+        
+        Returns:
+            MultiCollectionRetriever: A retriever searching all collections in parallel
+        """
+        collection_name = collection_name_for(username, chatbot_name)
+        
+        if not self.collection_exists(collection_name):
             raise HTTPException(
                 status_code=404, 
-                detail=f"FAISS index retrieval failed: {str(e)}"
+                detail=f"FAISS index retrieval failed: No index found for collection {collection_name}"
             )
-            
         
+        collection_names = [collection_name] + [name for name in linked_collections if name != collection_name]
+        
+        # Create and return a retriever
+        return MultiCollectionRetriever(
+            processor=self,
+            collection_names=collection_names,
+            k=5,  # Number of documents to retrieve
+            fetch_k=10  # Number of documents to consider before filtering
+        )
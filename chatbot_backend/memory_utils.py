@@ -1,154 +1,342 @@
-from typing import Dict, Optional,List
+from abc import ABC, abstractmethod
+from typing import Dict, Optional,List, Tuple
 from langchain.memory import ConversationBufferMemory
+from langchain_core.messages import BaseMessage, messages_from_dict, messages_to_dict
+import fcntl
 import json
+import tempfile
 from doc_process_utils import os
+from database_utils import get_db
 
 
+# Backing store for conversation state shared by every worker: "sqlite" uses
+# the application database, "file" the JSON files in user_memories/
+MEMORY_STORE_BACKEND = os.getenv("MEMORY_STORE_BACKEND", "sqlite")
+# How often a save is retried after another worker wrote the same conversation
+MEMORY_SAVE_RETRIES = 5
 
-class UserChatMemoryManager:
-    def __init__(self, user_id: str, memory_dir: str = "user_memories"):
+
+def _decode_messages(raw_messages: list) -> List[BaseMessage]:
+    # Files written before messages were serialized as dicts hold plain strings
+    # that cannot be turned back into messages, skip them
+    message_dicts = [message for message in raw_messages if isinstance(message, dict)]
+    return messages_from_dict(message_dicts)
+
+
+class MemoryStore(ABC):
+    """
+    Interface of a conversation store shared by all workers.
+
+    Every conversation carries a version. save() only succeeds if the stored
+    version still equals the version the caller loaded, so two workers
+    answering the same conversation cannot silently overwrite each other.
+    """
+
+    @abstractmethod
+    def load(self, user_id: str, chatbot_id: str) -> Tuple[List[BaseMessage], int]:
         """
-        Initialize a memory manager for a specific user
-        
+        Load a conversation
+
         Args:
             user_id (str): Unique identifier for the user
-            memory_dir (str, optional): Directory to store memory files
+            chatbot_id (str): Unique identifier for the chatbot
+
+        Returns:
+            Tuple[List[BaseMessage], int]: Messages and their version, 0 if none are stored
         """
-        self.user_id = user_id
+
+    @abstractmethod
+    def save(self, user_id: str, chatbot_id: str, messages: List[BaseMessage], expected_version: int) -> Optional[int]:
+        """
+        Store a conversation if nobody else wrote it since it was loaded
+
+        Args:
+            user_id (str): Unique identifier for the user
+            chatbot_id (str): Unique identifier for the chatbot
+            messages (List[BaseMessage]): Full conversation to store
+            expected_version (int): Version returned by load()
+
+        Returns:
+            Optional[int]: The new version, or None on a version conflict
+        """
+
+    @abstractmethod
+    def delete(self, user_id: str, chatbot_id: Optional[str] = None):
+        """
+        Delete one conversation, or all conversations of the user
+
+        Args:
+            user_id (str): Unique identifier for the user
+            chatbot_id (str, optional): Unique identifier for the chatbot
+        """
+
+
+class SQLiteMemoryStore(MemoryStore):
+    """
+    Conversation store in the application database, safe across workers
+    """
+
+    def load(self, user_id: str, chatbot_id: str) -> Tuple[List[BaseMessage], int]:
+        with get_db() as conn:
+            row = conn.execute(
+                "SELECT messages, version FROM conversation_memory WHERE user_id = ? AND chatbot_id = ?",
+                (user_id, chatbot_id)
+            ).fetchone()
+
+        if not row:
+            return [], 0
+        return _decode_messages(json.loads(row["messages"])), row["version"]
+
+    def save(self, user_id: str, chatbot_id: str, messages: List[BaseMessage], expected_version: int) -> Optional[int]:
+        payload = json.dumps(messages_to_dict(messages))
+        with get_db() as conn:
+            if expected_version == 0:
+                cursor = conn.execute("""
+                    INSERT INTO conversation_memory (user_id, chatbot_id, messages, version)
+                    VALUES (?, ?, ?, 1)
+                    ON CONFLICT(user_id, chatbot_id) DO NOTHING
+                """, (user_id, chatbot_id, payload))
+            else:
+                cursor = conn.execute("""
+                    UPDATE conversation_memory
+                    SET messages = ?, version = version + 1, updated_at = CURRENT_TIMESTAMP
+                    WHERE user_id = ? AND chatbot_id = ? AND version = ?
+                """, (payload, user_id, chatbot_id, expected_version))
+            conn.commit()
+
+        if cursor.rowcount != 1:
+            return None
+        return expected_version + 1
+
+    def delete(self, user_id: str, chatbot_id: Optional[str] = None):
+        with get_db() as conn:
+            if chatbot_id is None:
+                conn.execute("DELETE FROM conversation_memory WHERE user_id = ?", (user_id,))
+            else:
+                conn.execute(
+                    "DELETE FROM conversation_memory WHERE user_id = ? AND chatbot_id = ?",
+                    (user_id, chatbot_id)
+                )
+            conn.commit()
+
+
+class FileMemoryStore(MemoryStore):
+    """
+    Conversation store with one JSON file per conversation. Writes are
+    serialized with a file lock, so it is safe for workers sharing a volume.
+    """
+
+    def __init__(self, memory_dir: str = "user_memories"):
         self.memory_dir = memory_dir
-        self.memories: Dict[str, ConversationBufferMemory] = {}
-        
+
         # Ensure memory directory exists
         os.makedirs(self.memory_dir, exist_ok=True)
-    
-    def _get_memory_file_path(self, chatbot_id: str) -> str:
+
+    def _get_memory_file_path(self, user_id: str, chatbot_id: str) -> str:
+        return os.path.join(self.memory_dir, f"{user_id}_{chatbot_id}_memory.json")
+
+    def _read(self, memory_file: str) -> Tuple[List[BaseMessage], int]:
+        if not os.path.exists(memory_file):
+            return [], 0
+        with open(memory_file, 'r') as f:
+            memory_data = json.load(f)
+        return _decode_messages(memory_data.get('messages', [])), memory_data.get('version', 1)
+
+    def load(self, user_id: str, chatbot_id: str) -> Tuple[List[BaseMessage], int]:
+        return self._read(self._get_memory_file_path(user_id, chatbot_id))
+
+    def save(self, user_id: str, chatbot_id: str, messages: List[BaseMessage], expected_version: int) -> Optional[int]:
+        memory_file = self._get_memory_file_path(user_id, chatbot_id)
+        with open(f"{memory_file}.lock", 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                _, current_version = self._read(memory_file)
+                if current_version != expected_version:
+                    return None
+
+                fd, tmp_path = tempfile.mkstemp(dir=self.memory_dir)
+                with os.fdopen(fd, 'w') as f:
+                    json.dump({
+                        'messages': messages_to_dict(messages),
+                        'version': expected_version + 1
+                    }, f)
+                os.replace(tmp_path, memory_file)
+                return expected_version + 1
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def delete(self, user_id: str, chatbot_id: Optional[str] = None):
+        for filename in os.listdir(self.memory_dir):
+            if chatbot_id is None:
+                matches = filename.startswith(f"{user_id}_")
+            else:
+                matches = filename.startswith(f"{user_id}_{chatbot_id}_memory.json")
+            if matches:
+                os.remove(os.path.join(self.memory_dir, filename))
+
+
+class VersionedConversationMemory(ConversationBufferMemory):
+    """
+    Conversation memory that carries the stored version it was loaded from,
+    so saving it can detect and merge writes made by other workers
+    """
+
+    # None once the memory has been saved, a loaded memory is saved once
+    loaded_version: Optional[int] = None
+    loaded_message_count: int = 0
+
+
+def create_memory_store(backend: str = MEMORY_STORE_BACKEND) -> MemoryStore:
+    """
+    Create the configured conversation store
+
+    Args:
+        backend (str, optional): "sqlite" or "file"
+
+    Returns:
+        MemoryStore: The conversation store
+    """
+    if backend == "sqlite":
+        return SQLiteMemoryStore()
+    if backend == "file":
+        return FileMemoryStore()
+    raise ValueError(f"Unknown memory store backend: {backend}")
+
+
+class UserChatMemoryManager:
+    def __init__(self, user_id: str, store: MemoryStore):
         """
-        Generate a file path for a specific chatbot's memory
-        
+        Initialize a memory manager for a specific user
+
         Args:
-            chatbot_id (str): Unique identifier for the chatbot
-        
-        Returns:
-            str: Full path to the memory file
+            user_id (str): Unique identifier for the user
+            store (MemoryStore): Shared store holding the conversations
         """
-        return os.path.join(self.memory_dir, f"{self.user_id}_{chatbot_id}_memory.json")
-    
-    def get_or_create_memory(self, chatbot_id: str) -> ConversationBufferMemory:
+        self.user_id = user_id
+        self.store = store
+        self.memories: Dict[str, VersionedConversationMemory] = {}
+
+    def get_or_create_memory(self, chatbot_id: str) -> VersionedConversationMemory:
         """
-        Retrieve or create a memory for a specific chatbot
-        
+        Load a memory for a specific chatbot from the shared store. The memory
+        is loaded fresh on every call, since another worker may have answered
+        the last turn.
+
         Args:
             chatbot_id (str): Unique identifier for the chatbot
-        
+
         Returns:
-            ConversationBufferMemory: Memory object for the chatbot
+            VersionedConversationMemory: Memory object for the chatbot
         """
-        # Check if memory is already loaded
-        if chatbot_id in self.memories:
-            return self.memories[chatbot_id]
-        
         # Create a new memory object
-        memory = ConversationBufferMemory(
+        memory = VersionedConversationMemory(
                         memory_key="chat_history",  # Set a specific memory key
                         return_messages=True    # Return full message objects
                     )
-        
-        # Try to load existing memory from file
-        memory_file = self._get_memory_file_path(chatbot_id)
-        if os.path.exists(memory_file):
-            try:
-                with open(memory_file, 'r') as f:
-                    memory_data = json.load(f)
-                    memory.chat_memory.messages = memory_data.get('messages', [])
-            except Exception as e:
-                print(f"Error loading memory for chatbot {chatbot_id}: {e}")
-        
+
+        try:
+            messages, version = self.store.load(self.user_id, chatbot_id)
+        except Exception as e:
+            print(f"Error loading memory for chatbot {chatbot_id}: {e}")
+            messages, version = [], 0
+
+        memory.chat_memory.messages = list(messages)
+        memory.loaded_version = version
+        memory.loaded_message_count = len(messages)
+
         # Store in memory dictionary
         self.memories[chatbot_id] = memory
         return memory
-    
-    def save_memory(self, chatbot_id: str):
+
+    def save_memory(self, chatbot_id: str, memory: Optional[VersionedConversationMemory] = None):
         """
-        Save memory for a specific chatbot to a file
-        
+        Save memory for a specific chatbot to the shared store. If another
+        worker saved the conversation in the meantime, the messages added
+        since loading are appended to its version instead of overwriting it.
+
         Args:
             chatbot_id (str): Unique identifier for the chatbot
+            memory (VersionedConversationMemory, optional): Memory returned by
+                get_or_create_memory, defaults to the last one loaded
         """
-        if chatbot_id not in self.memories:
+        memory = memory or self.memories.get(chatbot_id)
+        if memory is None or memory.loaded_version is None:
             return
-        
-        memory = self.memories[chatbot_id]
-        memory_file = self._get_memory_file_path(chatbot_id)
-        
+
+        # A loaded memory is saved once, the next turn loads it again
+        version, base_count = memory.loaded_version, memory.loaded_message_count
+        memory.loaded_version = None
+        messages = list(memory.chat_memory.messages)
+        new_messages = messages[base_count:]
+
         try:
-            with open(memory_file, 'w') as f:
-                json.dump({
-                    'messages': memory.chat_memory.messages
-                }, f, default=lambda x: str(x))
+            for _ in range(MEMORY_SAVE_RETRIES):
+                new_version = self.store.save(self.user_id, chatbot_id, messages, version)
+                if new_version is not None:
+                    return
+
+                # Lost the race, replay this turn on top of the latest conversation
+                latest, version = self.store.load(self.user_id, chatbot_id)
+                messages = latest + new_messages
+
+            print(f"Error saving memory for chatbot {chatbot_id}: too many concurrent writes")
         except Exception as e:
             print(f"Error saving memory for chatbot {chatbot_id}: {e}")
-    
+
     def save_all_memories(self):
         """
         Save memories for all loaded chatbots
         """
         for chatbot_id in self.memories:
             self.save_memory(chatbot_id)
-    
+
     def clear_memory(self, chatbot_id: str):
         """
         Clear memory for a specific chatbot
-        
+
         Args:
             chatbot_id (str): Unique identifier for the chatbot
         """
-        if chatbot_id in self.memories:
-            del self.memories[chatbot_id]
-        
-        # Remove memory file
-        memory_file = self._get_memory_file_path(chatbot_id)
-        if os.path.exists(memory_file):
-            os.remove(memory_file)
-    
+        self.memories.pop(chatbot_id, None)
+        self.store.delete(self.user_id, chatbot_id)
+
     def clear_all_memories(self):
         """
         Clear all memories for the user
         """
-        # Remove all memory files
-        for filename in os.listdir(self.memory_dir):
-            if filename.startswith(f"{self.user_id}_"):
-                os.remove(os.path.join(self.memory_dir, filename))
-        
+        self.store.delete(self.user_id)
+
         # Clear memory dictionary
         self.memories.clear()
 
 # Example usage in a FastAPI endpoint
 class ChatbotMemoryManager:
-    def __init__(self):
+    def __init__(self, store: Optional[MemoryStore] = None):
+        self.store = store or create_memory_store()
         self.user_memory_managers: Dict[str, UserChatMemoryManager] = {}
-    
+
     def get_user_memory_manager(self, user_id: str) -> UserChatMemoryManager:
         """
         Get or create a memory manager for a specific user
-        
+
         Args:
             user_id (str): Unique identifier for the user
-        
+
         Returns:
             UserChatMemoryManager: Memory manager for the user
         """
         if user_id not in self.user_memory_managers:
-            self.user_memory_managers[user_id] = UserChatMemoryManager(user_id)
+            self.user_memory_managers[user_id] = UserChatMemoryManager(user_id, self.store)
         return self.user_memory_managers[user_id]
-    
+
     def get_chatbot_memory(self, user_id: str, chatbot_id: str):
         """
         Get memory for a specific chatbot
-        
+
         Args:
             user_id (str): Unique identifier for the user
             chatbot_id (str): Unique identifier for the chatbot
-        
+
         Returns:
             ConversationBufferMemory: Memory for the specific chatbot
         """
@@ -0,0 +1,36 @@
+import threading
+from typing import Dict
+
+
+class Metrics:
+    def __init__(self):
+        """
+        Process-wide counters exposed on the /metrics endpoint
+        """
+        self._lock = threading.Lock()
+        self._counters: Dict[str, int] = {}
+
+    def increment(self, name: str, amount: int = 1):
+        """
+        Increase a counter
+
+        Args:
+            name (str): Name of the counter
+            amount (int, optional): Value to add
+        """
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def snapshot(self) -> Dict[str, int]:
+        """
+        Get the current value of every counter
+
+        Returns:
+            Dict[str, int]: Counter values by name
+        """
+        with self._lock:
+            return dict(self._counters)
+
+
+# Shared by every module that reports metrics
+metrics = Metrics()
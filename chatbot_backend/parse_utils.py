@@ -0,0 +1,77 @@
+from langchain.text_splitter import CharacterTextSplitter
+from langchain_community.document_loaders import CSVLoader, TextLoader, PDFMinerLoader
+from langchain_core.documents import Document
+from typing import List, Optional, Tuple
+import os
+
+
+# Kept free of the embedding model and the vector store, so the processes
+# that parse uploads in parallel only import what parsing needs
+
+CHUNK_SIZE = 100
+CHUNK_OVERLAP = 20
+
+# Loader for each supported file extension
+DOCUMENT_LOADERS = {
+    ".txt": TextLoader,
+    ".md": TextLoader,
+    ".csv": CSVLoader,
+    ".pdf": PDFMinerLoader,
+}
+
+# start_index lets overlapping chunks of a source be merged back together
+text_splitter = CharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, add_start_index=True)
+
+
+def load_document(file_path: str) -> List[Document]:
+    """
+    Load a file with the loader registered for its extension
+
+    Args:
+        file_path (str): Path of the file to load
+
+    Returns:
+        List[Document]: Documents produced by the loader
+    """
+    loader_class = DOCUMENT_LOADERS.get(os.path.splitext(file_path)[1].lower())
+    if loader_class is None:
+        raise ValueError("Unsupported file format")
+    return loader_class(file_path).load()
+
+
+def split_document(file_path: str, document_id: str) -> List[Document]:
+    """
+    Load a file and split it into chunks tagged with their source document
+
+    Args:
+        file_path (str): Path of the file to load
+        document_id (str): Identifier of the source document
+
+    Returns:
+        List[Document]: Chunks carrying a "document_id" metadata entry
+    """
+    texts = text_splitter.split_documents(load_document(file_path))
+    for text in texts:
+        text.metadata["document_id"] = document_id
+    return texts
+
+
+def parse_file(file_path: str, document_id: str) -> Tuple[Optional[List[Document]], Optional[str]]:
+    """
+    split_document() for a worker process. Errors are returned as text, since
+    not every exception raised by a loader survives being sent back.
+
+    Args:
+        file_path (str): Path of the file to load
+        document_id (str): Identifier of the source document
+
+    Returns:
+        Tuple[Optional[List[Document]], Optional[str]]: The chunks, or the error
+    """
+    try:
+        texts = split_document(file_path, document_id)
+    except Exception as e:
+        return None, str(e) or type(e).__name__
+    if not texts:
+        return None, "Document contains no text"
+    return texts, None
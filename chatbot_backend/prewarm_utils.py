@@ -0,0 +1,196 @@
+from typing import Dict, List, Optional, Tuple
+from database_utils import get_db
+import math
+import os
+import threading
+import time
+
+
+# Seconds between writes of the buffered access statistics to the database
+ACCESS_STATS_FLUSH_INTERVAL = float(os.getenv("ACCESS_STATS_FLUSH_INTERVAL", "30"))
+# Seconds after which a past request counts half towards a collection's rate
+ACCESS_RATE_HALF_LIFE = float(os.getenv("ACCESS_RATE_HALF_LIFE", "3600"))
+# Hottest collections loaded in the background at startup
+PREWARM_TOP_N = int(os.getenv("PREWARM_TOP_N", "20"))
+# Upper bound for the index files loaded by prewarming
+PREWARM_MEMORY_BUDGET_MB = float(os.getenv("PREWARM_MEMORY_BUDGET_MB", "512"))
+
+
+def _decay(rate: float, since: float, now: float) -> float:
+    return rate * math.pow(0.5, max(0.0, now - since) / ACCESS_RATE_HALF_LIFE)
+
+
+class AccessStats:
+    def __init__(self, flush_interval: float = ACCESS_STATS_FLUSH_INTERVAL):
+        """
+        Per-collection access statistics: last use and an exponentially
+        decayed request rate. Hits are counted in memory and written to the
+        database periodically, so chats never wait on a write.
+
+        Args:
+            flush_interval (float, optional): Seconds between flushes
+        """
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        # collection -> (user_id, chatbot_name, hits, last_used)
+        self._pending: Dict[str, Tuple[int, str, int, float]] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def record(self, collection_name: str, user_id: int, chatbot_name: str):
+        """
+        Count one request to a collection
+
+        Args:
+            collection_name (str): Name of the collection
+            user_id (int): Owner of the chatbot
+            chatbot_name (str): Name of the chatbot
+        """
+        with self._lock:
+            _, _, hits, _ = self._pending.get(collection_name, (user_id, chatbot_name, 0, 0.0))
+            self._pending[collection_name] = (user_id, chatbot_name, hits + 1, time.time())
+
+    def flush(self):
+        """
+        Merge the buffered hits into the statistics in the database
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+
+        names = list(pending)
+        with get_db() as conn:
+            # Take the write lock before reading, so flushes from other workers
+            # cannot read the same rates and overwrite each other's update
+            conn.execute("BEGIN IMMEDIATE")
+            placeholders = ",".join("?" for _ in names)
+            existing = {
+                row["collection_name"]: (row["last_used"], row["request_rate"])
+                for row in conn.execute(
+                    f"SELECT collection_name, last_used, request_rate FROM collection_access WHERE collection_name IN ({placeholders})",
+                    names
+                ).fetchall()
+            }
+
+            rows = []
+            for name, (user_id, chatbot_name, hits, last_used) in pending.items():
+                previous_used, previous_rate = existing.get(name, (last_used, 0.0))
+                rate = _decay(previous_rate, previous_used, last_used) + hits
+                rows.append((name, user_id, chatbot_name, last_used, rate))
+
+            conn.executemany("""
+                INSERT INTO collection_access (collection_name, user_id, chatbot_name, last_used, request_rate)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(collection_name) DO UPDATE SET
+                    user_id = excluded.user_id,
+                    chatbot_name = excluded.chatbot_name,
+                    last_used = excluded.last_used,
+                    request_rate = excluded.request_rate
+            """, rows)
+            conn.commit()
+
+    def hottest(self, limit: int) -> List[dict]:
+        """
+        Collections with the highest request rate as of now
+
+        Args:
+            limit (int): Number of collections to return
+
+        Returns:
+            List[dict]: collection_name, user_id, chatbot_name and current rate
+        """
+        now = time.time()
+        with get_db() as conn:
+            rows = conn.execute(
+                "SELECT collection_name, user_id, chatbot_name, last_used, request_rate FROM collection_access"
+            ).fetchall()
+
+        ranked = [
+            {
+                "collection_name": row["collection_name"],
+                "user_id": row["user_id"],
+                "chatbot_name": row["chatbot_name"],
+                "rate": _decay(row["request_rate"], row["last_used"], now),
+            }
+            for row in rows
+        ]
+        ranked.sort(key=lambda entry: entry["rate"], reverse=True)
+        return ranked[:limit]
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error flushing access statistics: {e}")
+
+    def start(self):
+        """
+        Start flushing in the background
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="access-stats", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """
+        Stop flushing and write what is still buffered
+        """
+        self._stop.set()
+        self.flush()
+
+
+def prewarm(processor, registry, stats: AccessStats, top_n: int = PREWARM_TOP_N, memory_budget_mb: float = PREWARM_MEMORY_BUDGET_MB):
+    """
+    Load the embedding model and the hottest collections with their chatbot
+    metadata, so the first chats after a restart do not pay for it
+
+    Args:
+        processor (DocumentProcessor): Owner of the vector stores
+        registry (ChatbotRegistry): Chatbot metadata cache
+        stats (AccessStats): Access statistics to rank collections by
+        top_n (int, optional): Number of collections to consider
+        memory_budget_mb (float, optional): Budget for the loaded index files
+    """
+    started = time.monotonic()
+    processor.embedding_model.embed_query("warm up")
+
+    budget = memory_budget_mb * 1024 * 1024
+    loaded = set()
+    for entry in stats.hottest(top_n):
+        chatbot = registry.get(entry["user_id"], entry["chatbot_name"])
+        if not chatbot:
+            continue
+
+        for collection_name in [entry["collection_name"]] + chatbot["linked_collections"]:
+            # Small collections share a shard, which is loaded and charged once
+            index_name = processor.index_name_for(collection_name)
+            if index_name in loaded:
+                continue
+            size = processor.collection_size(collection_name)
+            if size == 0 or size > budget:
+                continue
+            if processor.preload_collection(collection_name):
+                budget -= size
+                loaded.add(index_name)
+
+    print(f"Prewarmed {len(loaded)} indexes in {time.monotonic() - started:.1f}s")
+
+
+def start_prewarm(processor, registry, stats: AccessStats) -> threading.Thread:
+    """
+    Run prewarm() in the background, the app serves requests meanwhile
+
+    Returns:
+        threading.Thread: The prewarming thread
+    """
+    def run():
+        try:
+            prewarm(processor, registry, stats)
+        except Exception as e:
+            print(f"Error prewarming collections: {e}")
+
+    thread = threading.Thread(target=run, name="prewarm", daemon=True)
+    thread.start()
+    return thread
@@ -1,5 +1,6 @@
 from pydantic import Field, BaseModel,EmailStr
 from datetime import datetime
+from typing import List, Optional
 
 class UserBase(BaseModel):
     username: str = Field(..., min_length=3, max_length=50)
@@ -22,12 +23,29 @@ class ChatbotCreate(BaseModel):
     description: str = Field(..., max_length=500)
     persona_prompt: str = Field(..., max_length=1000)
 
+class DocumentIngestResult(BaseModel):
+    filename: str
+    id: Optional[str] = None
+    chunk_count: int = 0
+    error: Optional[str] = None
+
 class ChatbotResponse(BaseModel):
     id: int
     name: str
     description: str
     persona_prompt: str
     created_at: datetime
+    linked_collections: List[str] = []
+    documents: List[DocumentIngestResult] = []
+
+class CollectionLinkRequest(BaseModel):
+    chatbot_names: List[str] = Field(..., max_length=20)
+
+class DocumentResponse(BaseModel):
+    id: str
+    filename: str
+    chunk_count: int
+    created_at: datetime
 
 class Token(BaseModel):
     access_token: str
@@ -0,0 +1,197 @@
+import os
+import tempfile
+import threading
+import uuid
+from typing import Dict, List, Optional, Tuple
+from database_utils import DATABASE_URL, get_db
+
+
+# Replaced on every registry write so other workers drop their cached metadata
+REGISTRY_STAMP_PATH = f"{DATABASE_URL}.registry-stamp"
+
+
+class ChatbotRegistry:
+    def __init__(self):
+        """
+        In-process registry of chatbot metadata keyed by (user_id, name).
+
+        A user's chatbots are loaded from the database on first access and
+        served from memory afterwards. Writers must call put() or invalidate()
+        so the registry never serves stale metadata; both also publish a stamp
+        file that other workers check before serving from their cache.
+        """
+        self._lock = threading.RLock()
+        # Rows per user, ordered the way /chatbots lists them (newest first)
+        self._rows: Dict[int, List[dict]] = {}
+        self._by_name: Dict[Tuple[int, str], dict] = {}
+        self._version = 0
+        self._seen_stamp = self._read_stamp()
+
+    @property
+    def version(self) -> int:
+        """
+        Registry-wide version stamp, bumped on every write or invalidation.
+        Downstream caches can key on it (or on an entry's "version").
+        """
+        return self._version
+
+    def _bump(self) -> int:
+        self._version += 1
+        return self._version
+
+    @staticmethod
+    def _read_stamp() -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(REGISTRY_STAMP_PATH)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def _publish(self):
+        """
+        Tell other workers that chatbot metadata changed
+        """
+        directory = os.path.dirname(os.path.abspath(REGISTRY_STAMP_PATH))
+        fd, tmp_path = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, "w") as f:
+            f.write(str(uuid.uuid4()))
+            f.flush()
+            stat = os.fstat(f.fileno())
+        os.replace(tmp_path, REGISTRY_STAMP_PATH)
+        # Our own write is not a reason to reload; any later one will differ
+        self._seen_stamp = (stat.st_ino, stat.st_mtime_ns)
+
+    def _sync(self):
+        """
+        Drop everything cached if another worker changed chatbot metadata
+        """
+        stamp = self._read_stamp()
+        if stamp != self._seen_stamp:
+            self._rows.clear()
+            self._by_name.clear()
+            self._bump()
+            self._seen_stamp = stamp
+
+    def _ensure_user(self, user_id: int):
+        """
+        Load every chatbot of a user into the registry if not already loaded
+
+        Args:
+            user_id (int): Owner of the chatbots
+        """
+        if user_id in self._rows:
+            return
+
+        with get_db() as conn:
+            rows = conn.execute("""
+                SELECT id, name, description, persona_prompt, created_at
+                FROM chatbots
+                WHERE user_id = ?
+                ORDER BY created_at DESC, id DESC
+            """, (user_id,)).fetchall()
+            links = conn.execute("""
+                SELECT chatbot_id, collection_name
+                FROM chatbot_collections
+                WHERE chatbot_id IN (SELECT id FROM chatbots WHERE user_id = ?)
+                ORDER BY collection_name
+            """, (user_id,)).fetchall()
+
+        linked_collections: Dict[int, List[str]] = {}
+        for link in links:
+            linked_collections.setdefault(link["chatbot_id"], []).append(link["collection_name"])
+
+        version = self._bump()
+        self._rows[user_id] = [
+            dict(row, linked_collections=linked_collections.get(row["id"], []), version=version)
+            for row in rows
+        ]
+        self._index_user(user_id)
+
+    def _index_user(self, user_id: int):
+        """
+        Rebuild the name lookup of a loaded user
+
+        Args:
+            user_id (int): Owner of the chatbots
+        """
+        for key in [key for key in self._by_name if key[0] == user_id]:
+            del self._by_name[key]
+
+        # On duplicate names the oldest chatbot wins, as the original lookup did
+        for entry in reversed(self._rows[user_id]):
+            self._by_name.setdefault((user_id, entry["name"]), entry)
+
+    def get(self, user_id: int, name: str) -> Optional[dict]:
+        """
+        Get metadata for a single chatbot
+
+        Args:
+            user_id (int): Owner of the chatbot
+            name (str): Name of the chatbot
+
+        Returns:
+            Optional[dict]: id, name, description, persona_prompt, created_at,
+            linked_collections and version of the chatbot, or None if it does
+            not exist
+        """
+        with self._lock:
+            self._sync()
+            self._ensure_user(user_id)
+            return self._by_name.get((user_id, name))
+
+    def list_chatbots(self, user_id: int) -> List[dict]:
+        """
+        List metadata for all chatbots of a user, newest first
+
+        Args:
+            user_id (int): Owner of the chatbots
+
+        Returns:
+            List[dict]: Chatbot metadata entries
+        """
+        with self._lock:
+            self._sync()
+            self._ensure_user(user_id)
+            return list(self._rows[user_id])
+
+    def put(self, user_id: int, chatbot: dict):
+        """
+        Write-through update after a chatbot has been created or edited
+
+        Args:
+            user_id (int): Owner of the chatbot
+            chatbot (dict): Row as stored in the database, must include id
+        """
+        with self._lock:
+            self._sync()
+            self._publish()
+            if user_id not in self._rows:
+                # Nothing cached yet, the next read loads the row from the DB
+                self._bump()
+                return
+
+            entry = dict(chatbot, version=self._bump())
+            entry.setdefault("linked_collections", [])
+            rows = [row for row in self._rows[user_id] if row["id"] != entry["id"]]
+            rows.append(entry)
+            rows.sort(key=lambda row: (str(row["created_at"]), row["id"]), reverse=True)
+            self._rows[user_id] = rows
+            self._index_user(user_id)
+
+    def invalidate(self, user_id: Optional[int] = None):
+        """
+        Drop cached metadata so it is reloaded from the database
+
+        Args:
+            user_id (int, optional): Only drop this user's chatbots
+        """
+        with self._lock:
+            self._publish()
+            if user_id is None:
+                self._rows.clear()
+                self._by_name.clear()
+            elif user_id in self._rows:
+                self._rows[user_id] = []
+                self._index_user(user_id)
+                del self._rows[user_id]
+            self._bump()
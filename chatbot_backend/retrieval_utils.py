@@ -0,0 +1,105 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, List, Tuple
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_community.vectorstores.utils import maximal_marginal_relevance
+from pydantic import ConfigDict
+import numpy as np
+import os
+
+
+# Threads shared by all requests for searching collections in parallel
+RETRIEVAL_WORKERS = int(os.getenv("RETRIEVAL_WORKERS", "8"))
+# Seconds a linked collection's search may take before it is left out of the answer
+COLLECTION_SEARCH_TIMEOUT = float(os.getenv("COLLECTION_SEARCH_TIMEOUT", "2.0"))
+
+_search_executor = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS, thread_name_prefix="retrieval")
+
+
+class MultiCollectionRetriever(BaseRetriever):
+    """
+    Retriever that searches several collections in parallel and applies
+    Maximum Marginal Relevance to the merged candidates.
+
+    Each collection returns its fetch_k nearest chunks with a relevance score
+    normalized to (0, 1]. The candidates of all collections are merged into a
+    global top fetch_k, from which MMR selects the final k chunks. Linked
+    collections that fail or do not answer within the timeout are skipped, the
+    first collection, the chatbot's own, is always searched.
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    processor: Any
+    collection_names: List[str]
+    k: int = 5
+    fetch_k: int = 10
+    lambda_mult: float = 0.5
+    timeout: float = COLLECTION_SEARCH_TIMEOUT
+
+    def _search_all(self, embedding: List[float]) -> List[Tuple[Document, float, np.ndarray]]:
+        primary = self.collection_names[0]
+
+        # Stores are loaded before the timed search, a collection that is cold
+        # or was just rewritten would otherwise never answer in time
+        loads = {
+            _search_executor.submit(self.processor.preload_collection, name): name
+            for name in self.collection_names
+        }
+        names = []
+        for future, name in loads.items():
+            try:
+                future.result()
+            except Exception as e:
+                if name == primary:
+                    raise
+                print(f"Loading collection {name} failed, skipping it: {e}")
+                continue
+            names.append(name)
+
+        futures = {
+            _search_executor.submit(self.processor.search_collection, name, embedding, self.fetch_k): name
+            for name in names
+        }
+        done, not_done = wait(futures, timeout=self.timeout)
+
+        candidates = []
+        for future, name in futures.items():
+            if name == primary:
+                # The chatbot's own collection is never left out, it is waited
+                # for and its failure fails the request
+                candidates.extend(future.result())
+            elif future in not_done:
+                future.cancel()
+                print(f"Search in collection {name} timed out, skipping it")
+            else:
+                try:
+                    candidates.extend(future.result())
+                except Exception as e:
+                    print(f"Search in collection {name} failed: {e}")
+        return candidates
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        embedding = self.processor.embedding_model.embed_query(query)
+
+        if len(self.collection_names) == 1:
+            candidates = self.processor.search_collection(self.collection_names[0], embedding, self.fetch_k)
+        else:
+            candidates = self._search_all(embedding)
+
+        if not candidates:
+            return []
+
+        # Global top fetch_k across collections, then MMR over their vectors
+        candidates.sort(key=lambda candidate: candidate[1], reverse=True)
+        candidates = candidates[:self.fetch_k]
+        selected = maximal_marginal_relevance(
+            np.array(embedding, dtype=np.float32),
+            [vector for _, _, vector in candidates],
+            k=min(self.k, len(candidates)),
+            lambda_mult=self.lambda_mult
+        )
+        return [candidates[i][0] for i in selected]
@@ -0,0 +1,231 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+from metrics_utils import metrics
+import groq
+import heapq
+import itertools
+import math
+import os
+import random
+import threading
+import time
+
+
+# Upstream LLM calls allowed to run at the same time in this process
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+# Calls allowed to wait for a slot; beyond this requests are rejected with 429
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "32"))
+# Seconds a call may wait for a slot before it is rejected with 503
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+# Retries of a call that hit an upstream rate limit or a transient error
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_BASE = 0.5
+LLM_BACKOFF_MAX = 8.0
+
+# Upstream errors worth retrying after a pause
+RETRYABLE_ERRORS = (
+    groq.RateLimitError,
+    groq.APIConnectionError,
+    groq.APITimeoutError,
+    groq.InternalServerError,
+)
+
+
+class LLMOverloadedError(Exception):
+    """
+    Raised when an LLM call cannot be admitted or keeps being rate limited.
+    Carries the HTTP status and the seconds the client should wait.
+    """
+
+    def __init__(self, message: str, retry_after: float, status_code: int = 503):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.status_code = status_code
+
+
+class LLMScheduler:
+    def __init__(
+        self,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        max_queue: int = LLM_MAX_QUEUE,
+        queue_timeout: float = LLM_QUEUE_TIMEOUT,
+        max_retries: int = LLM_MAX_RETRIES,
+    ):
+        """
+        Process-wide admission control for upstream LLM calls.
+
+        At most max_concurrency calls run at once; further calls wait in a
+        bounded priority queue (lower priority values are served first, ties
+        in arrival order). Identical calls in flight at the same time are
+        coalesced, so one upstream call serves every waiter.
+
+        Args:
+            max_concurrency (int, optional): Calls running at the same time
+            max_queue (int, optional): Calls allowed to wait for a slot
+            queue_timeout (float, optional): Seconds a call may wait for a slot
+            max_retries (int, optional): Retries after retryable upstream errors
+        """
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.max_retries = max_retries
+
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiting: List[Tuple[int, int]] = []
+        self._sequence = itertools.count()
+        self._inflight: Dict[Hashable, Future] = {}
+        # Moving average of call duration, used to estimate Retry-After
+        self._avg_latency = 2.0
+
+    def retry_after(self) -> float:
+        """
+        Estimate how long until a new call could be served
+
+        Returns:
+            float: Seconds to wait
+        """
+        backlog = len(self._waiting) + 1
+        return max(1.0, self._avg_latency * backlog / self.max_concurrency)
+
+    def ensure_capacity(self):
+        """
+        Reject early if a new call would not even fit in the queue, for callers
+        that cannot report an error once they have started responding
+        """
+        with self._cond:
+            if self._active >= self.max_concurrency and len(self._waiting) >= self.max_queue:
+                metrics.increment("llm_rejected")
+                raise LLMOverloadedError("LLM queue is full", self.retry_after(), status_code=429)
+
+    def _acquire(self, priority: int):
+        with self._cond:
+            if self._active < self.max_concurrency and not self._waiting:
+                self._active += 1
+                return
+
+            if len(self._waiting) >= self.max_queue:
+                metrics.increment("llm_rejected")
+                raise LLMOverloadedError("LLM queue is full", self.retry_after(), status_code=429)
+
+            ticket = (priority, next(self._sequence))
+            heapq.heappush(self._waiting, ticket)
+            metrics.increment("llm_queued")
+            deadline = time.monotonic() + self.queue_timeout
+
+            while not (self._active < self.max_concurrency and self._waiting[0] == ticket):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._waiting.remove(ticket)
+                    heapq.heapify(self._waiting)
+                    self._cond.notify_all()
+                    metrics.increment("llm_queue_timeouts")
+                    raise LLMOverloadedError("Timed out waiting for the LLM", self.retry_after())
+                self._cond.wait(remaining)
+
+            heapq.heappop(self._waiting)
+            self._active += 1
+            # The next ticket in line may be able to run too
+            self._cond.notify_all()
+
+    def _release(self):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+    @staticmethod
+    def _backoff(attempt: int, error: Exception) -> float:
+        response = getattr(error, "response", None)
+        header = response.headers.get("retry-after") if response is not None else None
+        try:
+            if header is not None:
+                return min(float(header), LLM_BACKOFF_MAX)
+        except ValueError:
+            pass
+        # Full jitter keeps retries of concurrent calls from lining up again
+        return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+
+    def _run(self, fn: Callable[[], Any], priority: int) -> Any:
+        self._acquire(priority)
+        try:
+            for attempt in range(self.max_retries + 1):
+                started = time.monotonic()
+                try:
+                    result = fn()
+                    self._avg_latency = 0.8 * self._avg_latency + 0.2 * (time.monotonic() - started)
+                    return result
+                except RETRYABLE_ERRORS as e:
+                    if attempt == self.max_retries:
+                        metrics.increment("llm_upstream_failures")
+                        raise LLMOverloadedError(
+                            f"LLM is unavailable: {str(e)}",
+                            max(self.retry_after(), self._backoff(attempt, e))
+                        ) from e
+                    metrics.increment("llm_retries")
+                    time.sleep(self._backoff(attempt, e))
+        finally:
+            self._release()
+
+    def submit(self, fn: Callable[[], Any], key: Optional[Hashable] = None, priority: int = 0) -> Any:
+        """
+        Run an LLM call under admission control
+
+        Args:
+            fn (Callable[[], Any]): The upstream call
+            key (Hashable, optional): Identity of the call; concurrent calls
+                with the same key share one upstream call
+            priority (int, optional): Lower values are served first
+
+        Returns:
+            Any: Result of the call
+        """
+        metrics.increment("llm_requests")
+        if key is None:
+            return self._run(fn, priority)
+
+        with self._cond:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+
+        if not leader:
+            metrics.increment("llm_coalesced")
+            return future.result()
+
+        try:
+            result = self._run(fn, priority)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._cond:
+                self._inflight.pop(key, None)
+
+
+# Shared by every LLM client in the process
+llm_scheduler = LLMScheduler()
+
+# Threads running chat chains, one for every call the scheduler lets run or
+# wait. Waiting calls hold these instead of the server's shared worker threads,
+# which also run authentication and uploads.
+chain_executor = ThreadPoolExecutor(
+    max_workers=LLM_MAX_CONCURRENCY + LLM_MAX_QUEUE,
+    thread_name_prefix="llm-chain"
+)
+
+
+def retry_after_header(error: LLMOverloadedError) -> Dict[str, str]:
+    """
+    Retry-After header for an error response
+
+    Args:
+        error (LLMOverloadedError): The admission error
+
+    Returns:
+        Dict[str, str]: Headers to send with the response
+    """
+    return {"Retry-After": str(math.ceil(error.retry_after))}
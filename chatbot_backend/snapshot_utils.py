@@ -0,0 +1,172 @@
+from typing import Any, Dict, List, Optional
+import hashlib
+import io
+import json
+import tarfile
+import time
+
+
+SNAPSHOT_FORMAT = "chatbot-snapshot"
+SNAPSHOT_VERSION = 1
+
+# Members of a snapshot archive, in the order they are written. The archive is
+# an uncompressed tar, so the index is stored byte for byte and is copied
+# straight into the vector database on import without being re-encoded.
+MANIFEST_MEMBER = "manifest.json"
+INDEX_MEMBER = "index.faiss"
+CHUNKS_MEMBER = "chunks.json"
+MEMORY_MEMBER = "memory.json"
+_COPY_BUFFER_SIZE = 1024 * 1024
+
+
+class SnapshotError(ValueError):
+    """
+    Raised for archives that are not valid chatbot snapshots
+    """
+
+
+def _sha256_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(_COPY_BUFFER_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _add_bytes(tar: tarfile.TarFile, name: str, data: bytes):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = int(time.time())
+    tar.addfile(info, io.BytesIO(data))
+
+
+def write_snapshot(
+    archive_path: str,
+    chatbot: Dict[str, Any],
+    documents: List[Dict[str, Any]],
+    index_path: str,
+    chunks: List[dict],
+    messages: List[dict],
+    embedding_model: str,
+):
+    """
+    Write a chatbot snapshot archive
+
+    Args:
+        archive_path (str): File the archive is written to
+        chatbot (Dict[str, Any]): name, description and persona_prompt
+        documents (List[Dict[str, Any]]): Document records of the chatbot
+        index_path (str): Raw FAISS index of the chatbot's collection
+        chunks (List[dict]): Chunks of the collection, in index order
+        messages (List[dict]): Conversation, as produced by messages_to_dict
+        embedding_model (str): Model the vectors were embedded with
+    """
+    chunks_data = json.dumps(chunks).encode("utf-8")
+    memory_data = json.dumps(messages).encode("utf-8")
+
+    manifest = {
+        "format": SNAPSHOT_FORMAT,
+        "version": SNAPSHOT_VERSION,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "embedding_model": embedding_model,
+        "chatbot": chatbot,
+        "documents": documents,
+        "chunk_count": len(chunks),
+        "checksums": {
+            INDEX_MEMBER: _sha256_file(index_path),
+            CHUNKS_MEMBER: hashlib.sha256(chunks_data).hexdigest(),
+            MEMORY_MEMBER: hashlib.sha256(memory_data).hexdigest(),
+        },
+    }
+
+    with tarfile.open(archive_path, "w") as tar:
+        # Manifest first, so an import can reject an archive before copying the index
+        _add_bytes(tar, MANIFEST_MEMBER, json.dumps(manifest, default=str).encode("utf-8"))
+        tar.add(index_path, arcname=INDEX_MEMBER)
+        _add_bytes(tar, CHUNKS_MEMBER, chunks_data)
+        _add_bytes(tar, MEMORY_MEMBER, memory_data)
+
+
+def read_snapshot(archive_path: str, index_path: str, embedding_model: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Read and verify a chatbot snapshot archive
+
+    Args:
+        archive_path (str): Snapshot archive
+        index_path (str): File the raw FAISS index is copied to
+        embedding_model (str, optional): Reject snapshots embedded with another model
+
+    Returns:
+        Dict[str, Any]: The manifest, plus the "chunks" and "messages" it describes
+    """
+    try:
+        tar = tarfile.open(archive_path, "r:")
+    except tarfile.TarError as e:
+        raise SnapshotError(f"Not a snapshot archive: {str(e)}")
+
+    with tar:
+        def member(name: str):
+            try:
+                f = tar.extractfile(name)
+            except KeyError:
+                f = None
+            if f is None:
+                raise SnapshotError(f"Snapshot is missing {name}")
+            return f
+
+        manifest = json.load(member(MANIFEST_MEMBER))
+        if manifest.get("format") != SNAPSHOT_FORMAT:
+            raise SnapshotError("Not a chatbot snapshot")
+        if manifest.get("version") != SNAPSHOT_VERSION:
+            raise SnapshotError(f"Unsupported snapshot version {manifest.get('version')}")
+        if embedding_model and manifest.get("embedding_model") != embedding_model:
+            raise SnapshotError(f"Snapshot was embedded with {manifest.get('embedding_model')}")
+
+        checksums = manifest.get("checksums", {})
+
+        digest = hashlib.sha256()
+        with member(INDEX_MEMBER) as source, open(index_path, "wb") as target:
+            for block in iter(lambda: source.read(_COPY_BUFFER_SIZE), b""):
+                digest.update(block)
+                target.write(block)
+
+        contents = {INDEX_MEMBER: digest.hexdigest()}
+        data = {}
+        for name in (CHUNKS_MEMBER, MEMORY_MEMBER):
+            data[name] = member(name).read()
+            contents[name] = hashlib.sha256(data[name]).hexdigest()
+
+        for name, checksum in contents.items():
+            if checksums.get(name) != checksum:
+                raise SnapshotError(f"Checksum mismatch for {name}")
+
+    chunks = json.loads(data[CHUNKS_MEMBER])
+    if len(chunks) != manifest.get("chunk_count"):
+        raise SnapshotError("Chunk count does not match the manifest")
+
+    return dict(manifest, chunks=chunks, messages=json.loads(data[MEMORY_MEMBER]))
+
+
+def remap_document_ids(chunks: List[dict], id_map: Dict[str, str]) -> List[dict]:
+    """
+    Give imported chunks new document ids, so one snapshot can be imported
+    several times without clashing with the documents it came from
+
+    Args:
+        chunks (List[dict]): Chunks read from a snapshot
+        id_map (Dict[str, str]): New document id for every old one
+
+    Returns:
+        List[dict]: Chunks with new ids and document_id metadata
+    """
+    remapped = []
+    for chunk in chunks:
+        metadata = dict(chunk["metadata"])
+        chunk_id = chunk["id"]
+        old_document_id = metadata.get("document_id")
+        if old_document_id in id_map:
+            metadata["document_id"] = id_map[old_document_id]
+            if chunk_id.startswith(f"{old_document_id}-"):
+                chunk_id = id_map[old_document_id] + chunk_id[len(old_document_id):]
+        remapped.append({"id": chunk_id, "page_content": chunk["page_content"], "metadata": metadata})
+    return remapped
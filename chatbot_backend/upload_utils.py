@@ -0,0 +1,108 @@
+from typing import List, Tuple
+from parse_utils import DOCUMENT_LOADERS
+import os
+import uuid
+import zipfile
+import zlib
+
+
+# Documents a single upload may contain, counting the members of archives
+MAX_UPLOAD_FILES = int(os.getenv("MAX_UPLOAD_FILES", "500"))
+# Bytes the members of one archive may expand to
+MAX_ARCHIVE_SIZE_MB = float(os.getenv("MAX_ARCHIVE_SIZE_MB", "200"))
+_COPY_BUFFER_SIZE = 1024 * 1024
+
+
+class UploadError(ValueError):
+    """
+    Raised for uploads that are rejected as a whole
+    """
+
+
+def file_extension(filename: str) -> str:
+    """
+    Lowercase extension of a file name, including the dot
+
+    Args:
+        filename (str): Name of the file
+
+    Returns:
+        str: Extension, empty if the name has none
+    """
+    return os.path.splitext(filename or "")[1].lower()
+
+
+def _extract_archive(filename: str, path: str, work_dir: str, limit: int) -> Tuple[List[Tuple[str, str]], List[Tuple[str, str]]]:
+    files = []
+    skipped = []
+    budget = MAX_ARCHIVE_SIZE_MB * 1024 * 1024
+
+    with zipfile.ZipFile(path) as archive:
+        for member in archive.infolist():
+            basename = os.path.basename(member.filename)
+            if member.is_dir() or basename.startswith(".") or member.filename.startswith("__MACOSX/"):
+                continue
+
+            name = f"{filename}/{member.filename}"
+            extension = file_extension(basename)
+            if extension not in DOCUMENT_LOADERS:
+                skipped.append((name, "Unsupported file format"))
+                continue
+            if len(files) >= limit:
+                raise UploadError(f"An upload may contain at most {MAX_UPLOAD_FILES} documents")
+
+            # Members are written under generated names, so paths stored in the
+            # archive can never point outside work_dir
+            target = os.path.join(work_dir, f"{uuid.uuid4()}{extension}")
+            try:
+                with archive.open(member) as source, open(target, "wb") as out:
+                    # Count the bytes actually read, the sizes in the archive may lie
+                    for block in iter(lambda: source.read(_COPY_BUFFER_SIZE), b""):
+                        budget -= len(block)
+                        if budget < 0:
+                            raise UploadError(f"{filename} expands to more than {MAX_ARCHIVE_SIZE_MB:g} MB")
+                        out.write(block)
+            except (RuntimeError, zipfile.BadZipFile, NotImplementedError, zlib.error, EOFError) as e:
+                # Encrypted members, corrupt or truncated data or unsupported compression
+                skipped.append((name, str(e)))
+                continue
+            files.append((name, target))
+
+    return files, skipped
+
+
+def expand_uploads(uploads: List[Tuple[str, str]], work_dir: str) -> Tuple[List[Tuple[str, str]], List[Tuple[str, str]]]:
+    """
+    Unpack the zip archives among uploaded files and set aside the files that
+    cannot be ingested
+
+    Args:
+        uploads (List[Tuple[str, str]]): File name and saved path of every uploaded file
+        work_dir (str): Directory archive members are extracted to
+
+    Returns:
+        Tuple[List[Tuple[str, str]], List[Tuple[str, str]]]: File name and path
+        of every document to ingest, and file name and reason of every file skipped
+    """
+    files = []
+    skipped = []
+    for filename, path in uploads:
+        extension = file_extension(filename)
+        if extension == ".zip":
+            try:
+                archive_files, archive_skipped = _extract_archive(
+                    filename, path, work_dir, MAX_UPLOAD_FILES - len(files)
+                )
+            except zipfile.BadZipFile as e:
+                skipped.append((filename, f"Not a valid zip archive: {str(e)}"))
+                continue
+            files.extend(archive_files)
+            skipped.extend(archive_skipped)
+        elif extension in DOCUMENT_LOADERS:
+            if len(files) >= MAX_UPLOAD_FILES:
+                raise UploadError(f"An upload may contain at most {MAX_UPLOAD_FILES} documents")
+            files.append((filename, path))
+        else:
+            skipped.append((filename, "Unsupported file format"))
+
+    return files, skipped
@@ -1,11 +1,22 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
 import json
+import os
+import time
 from datetime import datetime
-from typing import Optional, Dict, List
+from typing import Dict, Iterator, List
 
 # Configuration
-API_URL = "http://34.203.75.2:8000"
+API_URL = os.getenv("API_URL", "http://34.203.75.2:8000")
+# Seconds to wait for the backend; uploads embed documents, chats call the LLM
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "10"))
+UPLOAD_TIMEOUT = float(os.getenv("UPLOAD_TIMEOUT", "300"))
+CHAT_TIMEOUT = float(os.getenv("CHAT_TIMEOUT", "120"))
+# Seconds the chatbot list is reused across reruns before it is fetched again
+CHATBOT_LIST_TTL = float(os.getenv("CHATBOT_LIST_TTL", "60"))
+# Sent by the backend before an error that ends a streamed reply
+STREAM_ERROR_MARKER = "\x00"
 
 # Initialize session state variables
 def init_session_state():
@@ -21,8 +32,28 @@ def init_session_state():
         st.session_state.current_page = 'main'
     if 'selected_chatbot' not in st.session_state:
         st.session_state.selected_chatbot = None
+    if 'chatbots_fetched_at' not in st.session_state:
+        st.session_state.chatbots_fetched_at = None
+    if 'chat_stream_failed' not in st.session_state:
+        st.session_state.chat_stream_failed = False
 
 class APIClient:
+    @staticmethod
+    def get_session() -> requests.Session:
+        # One keep-alive connection pool per user session, reused across reruns
+        if 'http_session' not in st.session_state:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            st.session_state.http_session = session
+        return st.session_state.http_session
+
+    @staticmethod
+    def invalidate_chatbots():
+        st.session_state.chatbots = []
+        st.session_state.chatbots_fetched_at = None
+
     def get_headers() -> Dict:
         if st.session_state.access_token:
             return {"Authorization": f"Bearer {st.session_state.access_token}"}
@@ -44,9 +75,10 @@ class APIClient:
     @classmethod
     def register(cls, username: str, email: str, password: str) -> bool:
         try:
-            response = requests.post(
+            response = cls.get_session().post(
                 f"{API_URL}/register",
-                json={"username": username, "email": email, "password": password}
+                json={"username": username, "email": email, "password": password},
+                timeout=REQUEST_TIMEOUT
             )
             result = cls.handle_response(response)
             if result:
@@ -60,9 +92,10 @@ class APIClient:
     @classmethod
     def login(cls, username: str, password: str) -> bool:
         try:
-            response = requests.post(
+            response = cls.get_session().post(
                 f"{API_URL}/token",
-                data={"username": username, "password": password}
+                data={"username": username, "password": password},
+                timeout=REQUEST_TIMEOUT
             )
             result = cls.handle_response(response)
             if result:
@@ -74,59 +107,94 @@ class APIClient:
             return False
 
     @classmethod
-    def create_chatbot(cls, name: str, description: str, persona_prompt: str, file) -> bool:
+    def create_chatbot(cls, name: str, description: str, persona_prompt: str, uploads) -> bool:
         try:
-            files = {"document": file}
+            # Every file goes under the same field, the backend ingests them in one pass
+            files = [("document", (upload.name, upload.getvalue(), upload.type)) for upload in uploads]
             data = {
                 "name": name,
                 "description": description,
                 "persona_prompt": persona_prompt
             }
-            response = requests.post(
+            response = cls.get_session().post(
                 f"{API_URL}/chatbots",
                 data=data,
                 files=files,
-                headers=cls.get_headers()
+                headers=cls.get_headers(),
+                timeout=UPLOAD_TIMEOUT
             )
-            return cls.handle_response(response) is not None
+            result = cls.handle_response(response)
+            if result is None:
+                return False
+            for document in result.get("documents", []):
+                if document.get("error"):
+                    st.warning(f"{document['filename']} was not indexed: {document['error']}")
+            cls.invalidate_chatbots()
+            return True
         except Exception as e:
             st.error(f"Connection error: {str(e)}")
             return False
 
     @classmethod
-    def get_chatbots(cls) -> List[Dict]:
+    def get_chatbots(cls, force: bool = False) -> List[Dict]:
+        fetched_at = st.session_state.chatbots_fetched_at
+        if not force and fetched_at is not None and time.monotonic() - fetched_at < CHATBOT_LIST_TTL:
+            return st.session_state.chatbots
+
         try:
-            response = requests.get(
+            response = cls.get_session().get(
                 f"{API_URL}/chatbots",
-                headers=cls.get_headers()
+                headers=cls.get_headers(),
+                timeout=REQUEST_TIMEOUT
             )
             result = cls.handle_response(response)
-            return result if result else []
+            if result is None:
+                return []
+            st.session_state.chatbots = result
+            st.session_state.chatbots_fetched_at = time.monotonic()
+            return result
         except Exception as e:
             st.error(f"Connection error: {str(e)}")
             return []
 
     @classmethod
-    def chat_with_bot(cls, chatbot_name: str, message: str) -> Optional[str]:
+    def stream_chat_with_bot(cls, chatbot_name: str, message: str) -> Iterator[str]:
+        # Set when the reply is cut short, so the partial text is not kept as an answer
+        st.session_state.chat_stream_failed = False
         try:
-            response = requests.post(
-                f"{API_URL}/chatbots/chat",
+            with cls.get_session().post(
+                f"{API_URL}/chatbots/chat/stream",
                 json={
                     "chatbot_name": chatbot_name,
                     "message": message
                 },
-                headers=cls.get_headers()
-            )
-            
-            response.raise_for_status()
-            
-            result = cls.handle_response(response)
-            
-            return result.get("response") if result else None
-        
+                headers=cls.get_headers(),
+                timeout=CHAT_TIMEOUT,
+                stream=True
+            ) as response:
+                if not 200 <= response.status_code < 300:
+                    st.session_state.chat_stream_failed = True
+                    cls.handle_response(response)
+                    return
+                response.encoding = response.encoding or "utf-8"
+                error = None
+                for chunk in response.iter_content(chunk_size=None, decode_unicode=True):
+                    if error is not None:
+                        error += chunk
+                        continue
+                    text, marker, rest = chunk.partition(STREAM_ERROR_MARKER)
+                    if text:
+                        yield text
+                    if marker:
+                        error = rest
+
+                if error is not None:
+                    st.session_state.chat_stream_failed = True
+                    st.error(error)
+
         except requests.RequestException as e:
+            st.session_state.chat_stream_failed = True
             st.error(f"Error communicating with chatbot: {str(e)}")
-            return None
 
 def render_login_page():
     st.header("Login")
@@ -159,16 +227,20 @@ def render_create_chatbot_page():
         name = st.text_input("Chatbot Name")
         description = st.text_area("Description")
         persona_prompt = st.text_area("Persona Prompt")
-        file = st.file_uploader("Upload Training Document", type=["txt", "pdf"])
+        files = st.file_uploader(
+            "Upload Training Documents",
+            type=["txt", "md", "csv", "pdf", "zip"],
+            accept_multiple_files=True
+        )
         submit = st.form_submit_button("Create Chatbot")
 
         if submit:
-            if not all([name, description, persona_prompt, file]):
+            if not all([name, description, persona_prompt, files]):
                 st.error("All fields are required!")
             else:
-                if APIClient.create_chatbot(name, description, persona_prompt, file):
+                if APIClient.create_chatbot(name, description, persona_prompt, files):
                     st.success("Chatbot created successfully!")
-                    st.session_state.chatbots = APIClient.get_chatbots()
+                    st.session_state.chatbots = APIClient.get_chatbots(force=True)
                     st.rerun()
 
 def render_chat_interface(chatbot):
@@ -206,13 +278,17 @@ def render_chat_interface(chatbot):
             {"role": "user", "content": prompt}
         )
         
-        # Get chatbot response
-        response = APIClient.chat_with_bot(chatbot['name'], prompt)
-        if response:
+        with chat_container:
+            with st.chat_message("user"):
+                st.write(prompt)
+            # Render the response as it is generated
+            with st.chat_message("assistant"):
+                response = st.write_stream(APIClient.stream_chat_with_bot(chatbot['name'], prompt))
+        if response and not st.session_state.chat_stream_failed:
             st.session_state[f"messages_{chatbot['id']}"].append(
                 {"role": "assistant", "content": response}
             )
-        st.rerun()
+            st.rerun()
 
 def render_chatbot_list():
     st.header("My Chatbots")
@@ -257,6 +333,7 @@ def main():
     else:
         # Show logout button
         if st.sidebar.button("Logout"):
+            APIClient.invalidate_chatbots()
             st.session_state.access_token = None
             st.session_state.user_info = None
             st.session_state.current_page = 'main'